@@ -0,0 +1,362 @@
+"""
+Offline benchmarks of the four Loop nodes, without ComfyUI : folder_paths, server, comfy and aiohttp are replaced by the stand-ins of
+benchmarks/stand_ins when they can't be imported. Every case reports the node call time, the time of the background work it left (previews, writes)
+and the peak resident memory above the level before the call, as JSON.
+    python benchmarks/run_benchmarks.py --quick --out results.json
+    python benchmarks/run_benchmarks.py --compare results.json --threshold 0.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import statistics
+import importlib
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(os.path.join(BENCH_DIR, "stand_ins")) # last : installed modules win, stand-ins only fill the missing ones
+
+import torch
+import folder_paths
+
+def load_package(name: str = "comfyui_loop"):
+    """
+    Import the package nodes without running its __init__ (which copies preview icons into the ComfyUI tree).
+    """
+    package = types.ModuleType(name)
+    package.__path__ = [PACKAGE_DIR]
+    sys.modules[name] = package
+    return importlib.import_module(f"{name}.nodes")
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Silence the package logging (node progress, expected warnings) below errors.
+    """
+    logger = logging.getLogger("comfyui_loop")
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+def rss_bytes() -> int | None:
+    """
+    Current resident memory of the process (Linux /proc, else psutil if installed).
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return None
+
+class PeakMemory:
+    """
+    Sample the resident memory in a thread while the block runs, peak is relative to the level at entry.
+    torch CPU allocations are not seen by tracemalloc, the resident size catches them all.
+    """
+
+    INTERVAL = 0.001
+
+    def __enter__(self):
+        self.start = rss_bytes()
+        self.peak = self.start
+        self.running = self.start is not None
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        if self.running:
+            self.thread.start()
+        return self
+
+    def _sample(self):
+        while self.running:
+            self.peak = max(self.peak, rss_bytes())
+            time.sleep(self.INTERVAL)
+
+    def __exit__(self, *args):
+        if self.start is None:
+            return
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+    @property
+    def peak_mb(self) -> float | None:
+        return None if self.start is None else (self.peak - self.start) / 1024 ** 2
+
+class Bench:
+    """
+    Run and record cases. setup() runs before each call, out of the timings. Progress goes to stderr.
+    """
+
+    def __init__(self, nodes, repeat: int, warmup: int, filter: str | None):
+        self.nodes = nodes
+        self.repeat = repeat
+        self.warmup = warmup
+        self.filter = filter
+        self.results = []
+
+    def drain(self):
+        """
+        Wait for the background work left by a call : preview jobs and pending writes.
+        """
+        self.nodes.PM.executor.submit(lambda: None).result()
+        self.nodes.WM.flush()
+
+    def run(self, node: str, case: str, params: dict, call, setup=None):
+        name = f"{node}/{case}"
+        if self.filter and self.filter not in name:
+            return
+        calls, background, peaks = [], [], []
+        for i in range(self.warmup + self.repeat):
+            if setup is not None:
+                setup()
+            with PeakMemory() as memory, quiet():
+                start = time.perf_counter()
+                call()
+                called = time.perf_counter()
+                self.drain()
+                drained = time.perf_counter()
+            if i >= self.warmup:
+                calls.append((called - start) * 1000)
+                background.append((drained - called) * 1000)
+                peaks.append(memory.peak_mb)
+        result = {
+            "node": node,
+            "case": case,
+            "params": params,
+            "ms": {"min": min(calls), "median": statistics.median(calls), "mean": statistics.fmean(calls)},
+            "background_ms": statistics.median(background),
+            "peak_rss_mb": None if peaks[0] is None else max(peaks),
+        }
+        self.results.append(result)
+        print(f"{name:<48} {result['ms']['median']:10.2f} ms  +{result['background_ms']:8.2f} ms bg  "
+              + ("" if result["peak_rss_mb"] is None else f"{result['peak_rss_mb']:9.1f} MB"), file=sys.stderr, flush=True)
+
+def image_cases(bench: Bench, resolutions: list[int], batches: list[int]):
+    N = bench.nodes
+    crop, paste, loop, save = N.ImageCropLoop(), N.ImagePasteLoop(), N.LoopAny(), N.SaveAny()
+    output = folder_paths.get_output_directory()
+
+    for res in resolutions:
+        for b in batches:
+            params = {"width": res, "height": res, "batch": b}
+            image = torch.rand(b, res, res, 3)
+            mask = torch.rand(b, res, res)
+            size = min(512, res)
+            cut, cut_mask = torch.rand(b, size, size, 3), torch.rand(b, size, size)
+
+            bench.run("ImageCropLoop", f"crop {res}px b{b}", params,
+                      lambda: crop.click_and_crop(image, res // 4, res // 4, size, "red", True, "crop", mask))
+            bench.run("ImageCropLoop", f"crop tiled {res}px b{b}", params,
+                      lambda: crop.click_and_crop(image, 0, 0, size, "red", True, "crop", mask, tiled=True, overlap=64))
+            bench.run("ImagePasteLoop", f"paste {res}px b{b}", params,
+                      lambda: paste.paste_and_forget(image, cut, res // 4, res // 4))
+            bench.run("ImagePasteLoop", f"paste masked {res}px b{b}", params,
+                      lambda: paste.paste_and_forget(image, cut, res // 4, res // 4, cut_mask))
+
+            for image_format in N.IU.IMAGE_FORMATS:
+                tag = image_format.replace(" ", "_")
+                filename = f"image_{res}_{b}_{tag}"
+                fmt = {**params, "format": image_format}
+                bench.run("LoopAny", f"image create {image_format} {res}px b{b}", fmt,
+                          lambda: loop.loop_that_thing(image, False, False, "", "loop", filename=filename, image_format=image_format))
+                bench.run("LoopAny", f"image load {image_format} {res}px b{b}", fmt,
+                          lambda: loop.loop_that_thing(image, True, True, "", "loop", filename=filename, image_format=image_format),
+                          setup=N.CM.clear) # the file was just rewritten by Save Any
+                path = os.path.join(output, filename + N.IU.IMAGE_FORMATS[image_format])
+                bench.run("SaveAny", f"image {image_format} {res}px b{b}", fmt,
+                          lambda: save.save_that_thing(image, path, False, False, True, "save"))
+                bench.run("SaveAny", f"image+alpha {image_format} {res}px b{b}", fmt,
+                          lambda: save.save_that_thing(image, path, False, False, True, "save", mask=mask))
+
+            mask_name = f"mask_{res}_{b}"
+            bench.run("LoopAny", f"mask create {res}px b{b}", params,
+                      lambda: loop.loop_that_thing(mask, False, False, "", "loop", filename=mask_name))
+            bench.run("LoopAny", f"mask load {res}px b{b}", params,
+                      lambda: loop.loop_that_thing(mask, True, False, "", "loop", filename=mask_name),
+                      setup=N.CM.clear)
+            bench.run("SaveAny", f"mask {res}px b{b}", params,
+                      lambda: save.save_that_thing(mask, os.path.join(output, mask_name + ".png"), False, False, True, "save"))
+
+        # canvas : crop, paste and save only touch the chunks under the crop
+        params = {"width": res, "height": res, "batch": 1}
+        image = torch.rand(1, res, res, 3)
+        with quiet():
+            canvas = loop.loop_that_thing(image, False, False, "", "loop", filename=f"canvas_{res}", image_format="canvas")[0]
+        size = min(512, res)
+        cut = torch.rand(1, size, size, 3)
+        bench.run("ImageCropLoop", f"crop canvas {res}px", params,
+                  lambda: crop.click_and_crop(canvas, res // 4, res // 4, size, "red", True, "crop"))
+        bench.run("ImagePasteLoop", f"paste canvas {res}px", params,
+                  lambda: paste.paste_and_forget(canvas, cut, res // 4, res // 4))
+        with quiet():
+            pasted = paste.paste_and_forget(canvas, cut, res // 4, res // 4)[0]
+        bench.run("SaveAny", f"canvas {res}px", params,
+                  lambda: save.save_that_thing(pasted, canvas.path, False, False, True, "save"))
+
+def latent_cases(bench: Bench, resolutions: list[int], batches: list[int]):
+    N = bench.nodes
+    loop, save = N.LoopAny(), N.SaveAny()
+    output = folder_paths.get_output_directory()
+    shapes = []
+    for res in resolutions:
+        for b in batches:
+            shapes.append((f"sd {res}px b{b}", (b, 4, res // 8, res // 8), None))
+            shapes.append((f"flux {res}px b{b}", (b, 16, res // 8, res // 8), None))
+        shapes.append((f"wan {res}px 81 frames", (1, 16, 21, res // 8, res // 8), None))
+    shapes.append(("stable audio 47s", (1, 64, 1024), "audio"))
+
+    for case, shape, latent_type in shapes:
+        latent = {"samples": torch.randn(shape)}
+        if latent_type:
+            latent["type"] = latent_type
+        filename = "latent_" + case.replace(" ", "_")
+        params = {"shape": list(shape)}
+        bench.run("LoopAny", f"latent create {case}", params,
+                  lambda: loop.loop_that_thing(latent, False, False, "", "loop", filename=filename))
+        bench.run("LoopAny", f"latent load {case}", params,
+                  lambda: loop.loop_that_thing(latent, True, False, "", "loop", filename=filename),
+                  setup=N.CM.clear)
+        bench.run("SaveAny", f"latent {case}", params,
+                  lambda: save.save_that_thing(latent, os.path.join(output, filename + ".latent"), False, False, True, "save"))
+
+def audio_cases(bench: Bench, durations: list[int]):
+    N = bench.nodes
+    loop, save = N.LoopAny(), N.SaveAny()
+    output = folder_paths.get_output_directory()
+    for seconds in durations:
+        audio = {"waveform": torch.randn(1, 2, 44100 * seconds) * 0.1, "sample_rate": 44100}
+        segment = {"waveform": torch.randn(1, 2, 44100) * 0.1, "sample_rate": 44100}
+        filename = f"audio_{seconds}s"
+        params = {"seconds": seconds, "channels": 2, "sample_rate": 44100}
+        bench.run("LoopAny", f"audio create {seconds}s", params,
+                  lambda: loop.loop_that_thing(audio, False, False, "", "loop", filename=filename))
+        bench.run("LoopAny", f"audio load {seconds}s", params,
+                  lambda: loop.loop_that_thing(audio, True, False, "", "loop", filename=filename),
+                  setup=N.CM.clear)
+        bench.run("SaveAny", f"audio {seconds}s", params,
+                  lambda: save.save_that_thing(audio, os.path.join(output, filename + ".flac"), False, False, True, "save"))
+        with quiet():
+            loop.loop_that_thing(audio, False, False, "", "loop", filename=filename, audio_mode="append")
+        bench.run("LoopAny", f"audio append load {seconds}s +10s context", params,
+                  lambda: loop.loop_that_thing(audio, True, False, "", "loop", filename=filename, audio_mode="append", context_seconds=10.0),
+                  setup=N.CM.clear)
+        bench.run("SaveAny", f"audio append 1s to {seconds}s", params,
+                  lambda: save.save_that_thing(segment, os.path.join(output, filename + ".audioloop"), False, False, True, "save"))
+
+def text_cases(bench: Bench):
+    N = bench.nodes
+    loop, save = N.LoopAny(), N.SaveAny()
+    output = folder_paths.get_output_directory()
+    text = "a prompt for the next loop iteration, " * 20
+    lines = "\n".join(f"prompt line {i}" for i in range(100000))
+    value = {"seed": 42, "steps": 20, "weights": list(range(10000))}
+    cases = [
+        ("string", text, {}, ".txt"),
+        ("int", 42, {}, ".txt"),
+        ("float", 0.5, {}, ".txt"),
+        ("typed dict", value, {"text_mode": "typed"}, ".json"),
+        ("journal latest", text, {"text_mode": "journal (latest)"}, ".journal"),
+        ("lines 100k", lines, {"text_mode": "lines", "line_count": 4}, ".txt"),
+    ]
+    for case, input, options, ext in cases:
+        filename = "text_" + case.replace(" ", "_")
+        bench.run("LoopAny", f"{case} create", options,
+                  lambda: loop.loop_that_thing(input, False, False, "", "loop", filename=filename, **options))
+        bench.run("LoopAny", f"{case} load", options,
+                  lambda: loop.loop_that_thing(input, True, False, "", "loop", filename=filename, **options),
+                  setup=N.CM.clear)
+        if case != "lines 100k": # lines files are read only
+            bench.run("SaveAny", case, options,
+                      lambda: save.save_that_thing(input, os.path.join(output, filename + ext), False, False, True, "save"))
+
+def compare(results: list[dict], baseline_path: str, threshold: float) -> list[str]:
+    """
+    Return the cases whose median call time grew by more than threshold (fraction) over the baseline results.
+    """
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {f"{r['node']}/{r['case']}": r for r in json.load(f)["results"]}
+    regressions = []
+    for r in results:
+        name = f"{r['node']}/{r['case']}"
+        before = baseline.get(name)
+        if before is None:
+            continue
+        ratio = r["ms"]["median"] / max(before["ms"]["median"], 1e-6)
+        if ratio > 1 + threshold:
+            regressions.append(f"{name} : {before['ms']['median']:.2f} ms -> {r['ms']['median']:.2f} ms (x{ratio:.2f})")
+    return regressions
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Loop nodes offline benchmarks")
+    parser.add_argument("--quick", action="store_true", help="small resolutions and batches only")
+    parser.add_argument("--repeat", type=int, default=5, help="timed calls per case")
+    parser.add_argument("--warmup", type=int, default=1, help="untimed calls per case")
+    parser.add_argument("--filter", default=None, help="only run cases whose node/case name contains this text")
+    parser.add_argument("--out", default=None, help="write the JSON results to this file (default : stdout)")
+    parser.add_argument("--work-dir", default=None, help="directory for the loop files (default : a temporary directory)")
+    parser.add_argument("--compare", default=None, help="baseline JSON results, exit with 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="(compare) allowed median slowdown, as a fraction")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="loop-bench-")
+    folder_paths.set_base_directory(work_dir)
+    for folder in (folder_paths.get_output_directory(), folder_paths.get_temp_directory()):
+        os.makedirs(folder, exist_ok=True)
+
+    torch.manual_seed(0)
+    nodes = load_package()
+    bench = Bench(nodes, args.repeat, args.warmup, args.filter)
+    resolutions, batches, durations = ([512, 1024], [1, 4], [10]) if args.quick else ([512, 2048, 4096], [1, 4], [10, 120])
+    try:
+        image_cases(bench, resolutions, batches)
+        latent_cases(bench, resolutions, batches)
+        audio_cases(bench, durations)
+        text_cases(bench)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "threads": torch.get_num_threads(),
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "quick": args.quick,
+        },
+        "results": bench.results,
+    }
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        regressions = compare(bench.results, args.compare, args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,18 @@
+"""
+Stand-in for aiohttp.web : the responses built by the loop route handlers, without a server.
+"""
+import json
+
+class Response:
+    def __init__(self, *, body: bytes | None = None, text: str | None = None, status: int = 200, headers: dict | None = None, content_type: str | None = None):
+        self.status = status
+        self.headers = dict(headers or {})
+        self.body = text.encode("utf-8") if text is not None else body
+        self.content_type = content_type or self.headers.get("Content-Type", "application/octet-stream")
+
+    @property
+    def text(self) -> str | None:
+        return self.body.decode("utf-8") if self.body is not None else None
+
+def json_response(data, *, status: int = 200, headers: dict | None = None, content_type: str = "application/json", dumps=json.dumps) -> Response:
+    return Response(text=dumps(data), status=status, headers=headers, content_type=content_type)
@@ -0,0 +1,6 @@
+"""
+Stand-in for ComfyUI comfy.comfy_types.node_typing.
+"""
+
+class IO:
+    ANY = "*"
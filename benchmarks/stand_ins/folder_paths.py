@@ -0,0 +1,19 @@
+"""
+Stand-in for ComfyUI folder_paths : output and temp directories under a benchmark work directory (see set_base_directory).
+"""
+import os
+
+base_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "work")
+
+def set_base_directory(path: str):
+    global base_directory
+    base_directory = path
+
+def get_output_directory() -> str:
+    return os.path.join(base_directory, "output")
+
+def get_temp_directory() -> str:
+    return os.path.join(base_directory, "temp")
+
+def get_input_directory() -> str:
+    return os.path.join(base_directory, "input")
@@ -0,0 +1,26 @@
+"""
+Stand-in for ComfyUI server : a PromptServer instance whose routes are ignored and events are counted, not sent.
+"""
+from collections import Counter
+
+class _Router:
+    def add_get(self, *args, **kwargs):
+        pass
+
+    def add_post(self, *args, **kwargs):
+        pass
+
+class _App:
+    def __init__(self):
+        self.router = _Router()
+
+class _Instance:
+    def __init__(self):
+        self.app = _App()
+        self.events = Counter()
+
+    def send_sync(self, event, data, sid=None):
+        self.events[event] += 1
+
+class PromptServer:
+    instance = _Instance()
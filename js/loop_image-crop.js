@@ -12,6 +12,7 @@ const CONSTANTS = {
     EXTENSION_NAME: "Comfy.ImagePreviewNode",
     EVENT_NAME: "crop-bridge-proxy",
     API_ENDPOINT: "/api/bridge/response",
+    PYRAMID_ENDPOINT: "/loop/preview",
     WIDGET_NAMES: ["x", "y", "size", "color"],
     MIN_NODE_SIZE: 300,
     PREVIEW_HEIGHT: 300,
@@ -32,9 +33,10 @@ const Utils = {
         return { w: img.naturalWidth, h: img.naturalHeight };
     },
 
-    calculateImageDimensions(img, availableWidth, availableHeight) {
-        const imgW = img.naturalWidth;
-        const imgH = img.naturalHeight;
+    calculateImageDimensions(img, availableWidth, availableHeight, previewData) {
+        // pyramid levels have different resolutions : layout uses the preview logical size
+        const imgW = previewData?.logical_width ?? img.naturalWidth;
+        const imgH = previewData?.logical_height ?? img.naturalHeight;
         const scale = Math.min(availableWidth / imgW, availableHeight / imgH, 1);
         const scaledW = imgW * scale;
         const scaledH = imgH * scale;
@@ -54,12 +56,26 @@ const Utils = {
         return { markerX, markerY, markerSize };
     },
 
-    constructImageURL(filename) {
+    constructImageURL(filename, version) {
+        // preview files names are recycled : version busts the browser cache
+        const rand = version ? `&rand=${version}` : "";
         return api.apiURL(
-            `/view?filename=${encodeURIComponent(filename)}&type=temp&subfolder=`
+            `/view?filename=${encodeURIComponent(filename)}&type=temp&subfolder=${rand}`
         );
     },
 
+    constructPyramidURL(nodeId, level, version) {
+        return api.apiURL(
+            `${CONSTANTS.PYRAMID_ENDPOINT}/${encodeURIComponent(nodeId)}/${level}?v=${version}`
+        );
+    },
+
+    pickPyramidLevel(pyramid, neededWidth) {
+        const levels = pyramid?.levels ?? [];
+        const index = levels.findIndex(([w]) => w >= neededWidth);
+        return index === -1 ? levels.length - 1 : index;
+    },
+
     colorNameToRgba(colorName, alpha) {
         const colors = {
             red: "255, 0, 0",
@@ -80,44 +96,87 @@ const Utils = {
     }
 };
 
-// Event handler for crop bridge proxy
-api.addEventListener(CONSTANTS.EVENT_NAME, (event) => {
-    console.log('Image Crop - Received event:', event.detail);
+// Bridge responses to the backend, batched : replies queued in the same frame are posted as one list
+const Bridge = {
+    queue: [],
+    scheduled: false,
+
+    respond(reply) {
+        this.queue.push(reply);
+        if (this.scheduled) return;
+        this.scheduled = true;
+        requestAnimationFrame(() => this.flush());
+    },
 
-    const { detail: data } = event;
+    async flush() {
+        const replies = this.queue;
+        this.queue = [];
+        this.scheduled = false;
+        try {
+            const response = await api.fetchApi(CONSTANTS.API_ENDPOINT, {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify(replies)
+            });
+            if (!response.ok) {
+                console.error("Failed to send responses to backend:", response.status);
+            }
+        } catch (error) {
+            console.error("Error sending responses to backend:", error);
+        }
+    }
+};
+
+// Preview updates are applied once per frame and per node, latest wins
+const PendingPreviews = {
+    updates: new Map(),
+    scheduled: false,
+
+    push(data) {
+        this.updates.set(data.id, data);
+        if (this.scheduled) return;
+        this.scheduled = true;
+        requestAnimationFrame(() => this.apply());
+    },
+
+    apply() {
+        const updates = [...this.updates.values()];
+        this.updates.clear();
+        this.scheduled = false;
+        updates.forEach(applyPreviewEvent);
+    }
+};
+
+const applyPreviewEvent = (data) => {
     const nodeId = parseInt(data.id);
     const targetNode = app.graph.getNodeById(nodeId);
 
     targetNode?.updatePreview?.({
+        nodeId: data.id,
+        pyramid: data.pyramid,
         filename: data.name,
+        version: data.version,
         maskFilename: data.mask,
+        maskVersion: data.mask_version,
         scale: data.scale,
         original_width: data.original_width,
         original_height: data.original_height
     });
     // // Send a response to backend (commented out for now)
-    // const reply = {
+    // Bridge.respond({
     //     id: data.id,
     //     modified_params: {
     //         x: targetNode?.widgetRefs?.x?.value ?? 128,
     //         y: targetNode?.widgetRefs?.y?.value ?? 64,
     //         size: targetNode?.widgetRefs?.size?.value ?? 512
     //     }
-    // };
-
-    // try {
-    //     const response = await api.fetchApi(CONSTANTS.API_ENDPOINT, {
-    //         method: "POST",
-    //         headers: { "Content-Type": "application/json" },
-    //         body: JSON.stringify(reply)
-    //     });
-        
-    //     if (!response.ok) {
-    //         console.error("Failed to send response to backend:", response.status);
-    //     }
-    // } catch (error) {
-    //     console.error("Error sending response to backend:", error);
-    // }
+    // });
+};
+
+// Event handler for crop bridge proxy
+api.addEventListener(CONSTANTS.EVENT_NAME, (event) => {
+    console.debug('Image Crop - Received event:', event.detail);
+    PendingPreviews.push(event.detail);
 });
 
 // Preview widget factory
@@ -139,6 +198,9 @@ const createPreviewWidget = (node) => ({
         }
 
         drawImageWithMarker(ctx, node, img, availableWidth, availableHeight, y);
+
+        // fetch a finer pyramid level if the preview is displayed (or zoomed) larger than the loaded one
+        node.requestPyramidLevel?.(node.neededPyramidLevel?.());
     }
 });
 
@@ -150,7 +212,7 @@ const drawPlaceholder = (ctx, widgetWidth, y) => {
 };
 
 const drawImageWithMarker = (ctx, node, img, availableWidth, availableHeight, y) => {
-    const dims = Utils.calculateImageDimensions(img, availableWidth, availableHeight);
+    const dims = Utils.calculateImageDimensions(img, availableWidth, availableHeight, node.previewData);
     const imgX = CONSTANTS.MARGIN + (availableWidth - dims.scaledW) / 2;
     const imgY = y + CONSTANTS.MARGIN + (availableHeight - dims.scaledH) / 2;
     const colorValue = node.widgetRefs.color?.value ?? "black";
@@ -414,13 +476,71 @@ const setupUpdatePreview = (nodeType) => {
             return;
         }
 
+        const scale = imageInfo.scale ?? 1;
+        const previousVersion = this.previewData?.pyramid?.version;
         this.previewData = {
-            scale: imageInfo.scale ?? 1,
+            scale: scale,
             original_width: imageInfo.original_width,
-            original_height: imageInfo.original_height
+            original_height: imageInfo.original_height,
+            logical_width: Math.max(1, Math.floor(imageInfo.original_width * scale)),
+            logical_height: Math.max(1, Math.floor(imageInfo.original_height * scale)),
+            nodeId: imageInfo.nodeId,
+            pyramid: imageInfo.pyramid
+        };
+
+        if (imageInfo.pyramid?.levels?.length) {
+            if (imageInfo.pyramid.version === previousVersion && this.previewLevel >= 0) {
+                this.loadPreviewMask(imageInfo); // same image, keep the loaded level
+                return;
+            }
+            this.previewLevel = -1;
+            this.requestedLevel = -1;
+            // coarse level first, finer levels only when needed
+            this.requestPyramidLevel(0);
+            this.requestPyramidLevel(this.neededPyramidLevel());
+        } else {
+            this.loadPreviewFile(imageInfo);
+        }
+
+        this.loadPreviewMask(imageInfo);
+    };
+
+    nodeType.prototype.neededPyramidLevel = function() {
+        const pyramid = this.previewData?.pyramid;
+        if (!pyramid?.levels?.length) return -1;
+
+        const displayWidth = this.imageArea?.width ?? this.previewData.logical_width;
+        const zoom = app.canvas?.ds?.scale ?? 1;
+        return Utils.pickPyramidLevel(pyramid, displayWidth * zoom * (window.devicePixelRatio || 1));
+    };
+
+    nodeType.prototype.requestPyramidLevel = function(level) {
+        const pyramid = this.previewData?.pyramid;
+        if (!pyramid || level < 0 || level <= this.requestedLevel) return;
+        this.requestedLevel = level;
+
+        // conditional GET : the browser revalidates with the ETag and gets a 304 if unchanged
+        const url = Utils.constructPyramidURL(this.previewData.nodeId, level, pyramid.version);
+        const img = new Image();
+
+        img.onload = () => {
+            // ignore a stale or coarser level arriving late
+            if (this.previewData?.pyramid?.version !== pyramid.version || level <= this.previewLevel) return;
+            this.previewLevel = level;
+            this.previewWidget.previewImage = img;
+            adjustNodeSize(this, img);
+            refreshCanvas(this);
         };
 
-        const url = Utils.constructImageURL(imageInfo.filename);
+        img.onerror = (e) => {
+            console.error("Failed to load preview level:", url, e);
+        };
+
+        img.src = url;
+    };
+
+    nodeType.prototype.loadPreviewFile = function(imageInfo) {
+        const url = Utils.constructImageURL(imageInfo.filename, imageInfo.version);
         console.log("Loading image from:", url);
         console.log("Preview data:", this.previewData);
 
@@ -439,9 +559,11 @@ const setupUpdatePreview = (nodeType) => {
         };
 
         img.src = url;
+    };
 
+    nodeType.prototype.loadPreviewMask = function(imageInfo) {
         if (imageInfo.maskFilename) {
-            const maskUrl = Utils.constructImageURL(imageInfo.maskFilename);
+            const maskUrl = Utils.constructImageURL(imageInfo.maskFilename, imageInfo.maskVersion);
             console.log("Loading mask from:", maskUrl);
 
             const maskImg = new Image();
@@ -1,16 +1,24 @@
 import torch
 import folder_paths
 import os
-import time
-import shutil
+import logging
 from comfy.comfy_types.node_typing import IO
-from server import PromptServer
 from .utils.loop_img_utils import LoopImageUtils as IU
 from .utils.loop_latent_utils import LoopLatentUtils as LU
 from .utils.loop_audio_utils import LoopAudioUtils as AU
 from .utils.loop_string_utils import LoopStringUtils as SU
 from .utils.loop_path_utils import LoopPathUtils as PU
+from .utils.loop_tile_utils import LoopTileUtils as TU
+from .utils.loop_canvas_utils import LoopCanvasUtils as CU
+from .utils.loop_preview_manager import preview_manager as PM
+from .utils.loop_history_utils import LoopHistoryUtils as HU
 from .utils.error_handler import ErrorHandler
+from .utils.loop_cache_manager import cache_manager as CM
+from .utils.loop_write_manager import write_manager as WM
+from .utils.loop_metrics_manager import metrics_manager as MM
+from .utils.loop_event_scheduler import event_scheduler as ES
+
+logger = logging.getLogger(__name__)
 
 """
 A simple image loop for your workflow. MIT License. version 0.2
@@ -40,8 +48,12 @@ class ImageCropLoop:
         self.preview_dim = 1024 # change this if you need a detailed preview.
         self.last_img_hash = None
         self.last_filename = None
+        self.last_version = 0
+        self.last_pyramid = None
         self.last_mask_hash = None
         self.last_maskname = None
+        self.last_mask_version = 0
+        PM.cleanup(self.output_dir) # previews left by a previous session
 
     @classmethod
     def INPUT_TYPES(s):
@@ -54,69 +66,129 @@ class ImageCropLoop:
                 "color": (["black","grey","red","green","blue"], {"default": "black", "tooltip": "Color of the crop rectangle in the preview."}),
                 "show_mask": ("BOOLEAN", {"default": True, "tooltip": "Show or hide preview mask"}),
             },
-            "optional": {"mask": ("MASK",)},
+            "optional": {
+                "mask": ("MASK",),
+                "tiled": ("BOOLEAN", {"default": False, "tooltip": "Cut the whole image in tiles of 'size' as one batch. Connect 'tiles' output to Paste Image to reassemble them."}),
+                "overlap": ("INT", {"default": 64, "min": 0, "max": 1024, "step": 8, "tooltip": "(tiled) overlap between tiles, feathered on paste."}),
+            },
             "hidden": {"id": "UNIQUE_ID"}
         }
 
     CATEGORY = "LOOP"
     DESCRIPTION = "Crop an image and mask at x,y coordinates with given size. Generate image and mask preview for interactive cropping."
     FUNCTION = "click_and_crop"
-    RETURN_TYPES = ("IMAGE","IMAGE","INT","INT","INT","MASK")
-    RETURN_NAMES = ("source","cut","size","x","y","cut_mask")
+    RETURN_TYPES = ("IMAGE","IMAGE","INT","INT","INT","MASK","STRING")
+    RETURN_NAMES = ("source","cut","size","x","y","cut_mask","tiles")
     
-    def click_and_crop(self, image, x, y, size, color, show_mask, id, mask=None):
+    @MM.timed("ImageCropLoop", "image")
+    def click_and_crop(self, image, x, y, size, color, show_mask, id, mask=None, tiled=False, overlap=64):
                 
         _, h, w, _ = image.shape
         size = min(size, h, w) # max crop size to image boundaries
         x, y = abs(x), abs(y)
         x, y = max(0, min(x, w - size)), max(0, min(y, h - size)) # keep crop into image limits
+        tiles = ""
 
-        cut = image[:, y:y+size, x:x+size, :]
+        if tiled and CU.is_canvas(image):
+            raise ValueError("Image Crop : tiled mode is not available on a canvas, crop it with x/y instead.")
 
-        # mask management
-        if mask is not None:
-            mask = IU.resize_mask(mask, h, w) # resize to image dimensions
-            cut_mask = mask[:, y:y+size, x:x+size]
+        if tiled:
+            # every tile of the image as one batch, with its mask tiles and grid
+            x, y = 0, 0
+            cut, cut_mask, tiles = TU.split_tiles(image, size, overlap, mask)
+            if cut_mask is None:
+                cut_mask = IU.get_default_mask(size, size).expand(cut.shape[0], -1, -1)
         else:
-            cut_mask = IU.get_default_mask(size, size)
+            # a canvas reads only the chunks under the crop
+            cut = image.read(x, y, size, size) if CU.is_canvas(image) else image[:, y:y+size, x:x+size, :]
+
+            # mask management
+            if mask is not None:
+                cut_mask = IU.crop_mask(mask, h, w, x, y, size) # as resized to image dimensions
+            else:
+                cut_mask = IU.get_default_mask(size, size)
+
+        # previews are generated off the critical path, outputs are returned at once
+        PM.submit(id, self.update_preview, image, mask, id)
+
+        return (image, cut, size, x, y, cut_mask, tiles)
+
+    def update_preview(self, is_current, image, mask, id):
+        """
+        Background job : save image and mask previews if they changed and send them to the node widget.
+        Stops early when a newer execution of the same node is submitted.
+        """
+        with MM.timer("loop_preview_seconds", node="ImageCropLoop"):
+            self._update_preview(is_current, image, mask, id)
+
+    def _update_preview(self, is_current, image, mask, id):
+        _, h, w, _ = image.shape
 
         # define preview scale
         scale = self.preview_dim / w if self.preview_dim < w else 1.0
 
+        # a canvas is previewed from its overview, scales are relative to the original size
+        if CU.is_canvas(image):
+            image = image.overview()
+        source_scale = min(1.0, scale * w / image.shape[2])
+
         # image preview management
-        current_img_hash = IU.compute_image_hash(image)
+        with MM.timer("loop_hash_seconds", kind="image"):
+            current_img_hash = IU.compute_image_hash(image)
         # print(f"image_hash_changed: {current_img_hash != self.last_img_hash}") # debug
 
-        if current_img_hash != self.last_img_hash or self.last_filename is None:
-            filename = IU.save_preview_image(image, self.output_dir, scale)
+        if current_img_hash != self.last_img_hash or not self._preview_exists(self.last_filename):
+            # preview pyramid, the legacy preview file is its preview_dim level
+            scales = PM.pyramid_scales(image.shape[2], source_scale)
+            self.last_pyramid = PM.set_pyramid(id, image, scales) # levels are built on request
+            filename, file_path, self.last_version = PM.acquire(self.output_dir, "loop_preview_", id, ".jpeg")
+            with open(file_path, "wb") as f:
+                f.write(PM.pyramid_level(id, scales.index(source_scale))[0])
+            PM.commit(file_path)
             self.last_img_hash = current_img_hash
             self.last_filename = filename
         else:
             filename = self.last_filename
+            MM.inc("loop_preview_skipped_total", node="ImageCropLoop", reason="unchanged")
+
+        if not is_current():
+            MM.inc("loop_preview_skipped_total", node="ImageCropLoop", reason="stale")
+            return
 
         # mask preview management
         if mask is not None:
-            current_mask_hash = IU.compute_mask_hash(mask)
+            with MM.timer("loop_hash_seconds", kind="mask"):
+                current_mask_hash = IU.compute_mask_hash(mask)
             # print(f"mask_hash_changed: {current_mask_hash != self.last_mask_hash}") # debug
 
-            if current_mask_hash != self.last_mask_hash or self.last_maskname is None:
-                maskname = IU.save_preview_mask(mask, self.output_dir, scale)
+            if current_mask_hash != self.last_mask_hash or not self._preview_exists(self.last_maskname):
+                maskname, file_path, self.last_mask_version = PM.acquire(self.output_dir, "loop_mask_preview_", id, ".png")
+                IU.save_preview_mask(mask, file_path, scale, (h, w)) # any mask size, resized to the preview only
+                PM.commit(file_path)
                 self.last_mask_hash = current_mask_hash
                 self.last_maskname = maskname
             else:
                 maskname = self.last_maskname
+                MM.inc("loop_preview_skipped_total", node="ImageCropLoop", reason="unchanged")
         else:
             maskname = None
             self.last_mask_hash = None
             self.last_maskname = None
 
-        # update preview
+        if not is_current():
+            MM.inc("loop_preview_skipped_total", node="ImageCropLoop", reason="stale")
+            return
+
+        # update preview, coalesced per node : only the latest pending preview of a fast loop is sent
         try:
             # print(f"Sending crop-bridge-proxy event (id={id}, filename={filename})") # debug
-            PromptServer.instance.send_sync("crop-bridge-proxy", {
+            ES.post("crop-bridge-proxy", id, {
                 "id": id,
                 "name": filename,
+                "version": self.last_version,
                 "mask": maskname,
+                "mask_version": self.last_mask_version,
+                "pyramid": self.last_pyramid,
                 "scale": scale,
                 "original_width": w,
                 "original_height": h
@@ -124,7 +196,11 @@ class ImageCropLoop:
         except Exception as e:
             ErrorHandler.handle_communication_error(e, "click_and_crop")
 
-        return (image, cut, size, x, y, cut_mask)
+    def _preview_exists(self, filename: str | None) -> bool:
+        """
+        Check a previous preview file is still there (it may have been evicted).
+        """
+        return filename is not None and os.path.exists(os.path.join(self.output_dir, filename))
 
     def IS_CHANGED(**kwargs):
         return float("NaN")
@@ -144,6 +220,7 @@ class ImagePasteLoop:
             },
             "optional": {
                 "cut_mask": ("MASK", {"tooltip": "Optional cutting mask."}),
+                "tiles": ("STRING", {"forceInput": True, "tooltip": "Optional tile grid from Image Crop (tiled). Reassemble the cut batch with feathered overlaps."}),
             },
         }
 
@@ -153,7 +230,14 @@ class ImagePasteLoop:
     RETURN_TYPES = ("IMAGE",)
     RETURN_NAMES = ("image",)
 
-    def paste_and_forget(self, source, cut, x, y, cut_mask=None):
+    @MM.timed("ImagePasteLoop", "source")
+    def paste_and_forget(self, source, cut, x, y, cut_mask=None, tiles=None):
+
+        if tiles:
+            # reassemble tiles as a full size cut and mask, pasted at origin
+            cut = TU.merge_tiles(cut, tiles)
+            cut_mask = TU.merge_tiles(cut_mask, tiles) if cut_mask is not None else None
+            x, y = 0, 0
 
         _, sh, sw, _ = source.shape
         _, ch, cw, _ = cut.shape
@@ -162,22 +246,60 @@ class ImagePasteLoop:
         x, y = max(0, min(x, sw - 1)), max(0, min(y, sh - 1))
         w, h = min(cw, sw - x), min(ch, sh - y)
 
-        result = source.clone()
-
-        # no mask? direct paste.
-        if cut_mask is None or cut_mask.max() == 0:
-            result[:, y:y+h, x:x+w, :] = cut[:, :h, :w, :]
-            return (result,)
-                            
-        # adjust and normalize mask
-        cut_mask = cut_mask[:, :h, :w].unsqueeze(-1).float()
-        cut_mask /= cut_mask.max() if cut_mask.max() > 0 else 1.0
-
-        # blend
-        region = result[:, y:y+h, x:x+w, :]
-        result[:, y:y+h, x:x+w, :] = cut[:, :h, :w, :] * cut_mask + region * (1 - cut_mask)
-
-        return (result,)            
+        if CU.is_canvas(source):
+            return (self.paste_on_canvas(source, cut, x, y, w, h, cut_mask),)
+
+        # batches broadcast : a single source/cut/mask is pasted into or with every element of the others
+        b = self._batch_size(source, cut, cut_mask)
+        result = source.expand(b, -1, -1, -1).clone() if source.shape[0] != b else source.clone() # callers' tensors are never modified
+        self._blend(result[:, y:y+h, x:x+w, :], cut, cut_mask)
+
+        return (result,)
+
+    def paste_on_canvas(self, canvas, cut, x, y, w, h, cut_mask=None):
+        """
+        Paste into a canvas : only the chunks under the cut are read, blended and kept as dirty chunks until saved.
+        """
+        region = canvas.read(x, y, w, h)
+        self._blend(region, cut[:1], cut_mask[:1] if cut_mask is not None else None)
+        return canvas.write(x, y, region[0])
+
+    @staticmethod
+    def _batch_size(source, cut, cut_mask=None) -> int:
+        sizes = {source.shape[0], cut.shape[0]} | ({cut_mask.shape[0]} if cut_mask is not None else set())
+        b = max(sizes)
+        if not sizes <= {1, b}:
+            raise ValueError(f"Paste Image : batch sizes {sorted(sizes)} can't be broadcast, use equal sizes or 1.")
+        return b
+
+    @staticmethod
+    def _blend(region, cut, cut_mask=None):
+        """
+        Blend cut into region (a view, modified in place) with an optional mask normalized to [0, 1].
+        No mask (or an empty one) is a direct paste. Only the mask occupancy strips are touched :
+        transparent pixels are skipped, opaque strips are copied, the others are blended.
+        """
+        _, h, w, _ = region.shape
+        cut = cut[:, :h, :w, :].to(region.device, region.dtype)
+
+        stats = IU.mask_stats(cut_mask) if cut_mask is not None else None # cached, single reduction
+        if stats is None or stats["max"] == 0:
+            region.copy_(cut)
+            return
+
+        mask_max = stats["max"]
+        for y0, y1, x0, x1, opaque in stats["strips"]:
+            y1, x1 = min(y1, h), min(x1, w)
+            if y0 >= y1 or x0 >= x1:
+                continue
+            target = region[:, y0:y1, x0:x1, :]
+            if opaque:
+                target.copy_(cut[:, y0:y1, x0:x1, :])
+                continue
+            weight = cut_mask[:, y0:y1, x0:x1].unsqueeze(-1).to(region.device, region.dtype)
+            if mask_max != 1.0:
+                weight = weight / mask_max # new tensor, the caller's mask is left untouched
+            target.lerp_(cut[:, y0:y1, x0:x1, :], weight)
 
 class LoopAny:
     """
@@ -197,7 +319,14 @@ class LoopAny:
                 "loop_mask": ("BOOLEAN", {"default": False, "tooltip": "Enable mask loop mode. Disable to load from mask input"}),
             },
             "optional": {
-                "mask": ("MASK", {})
+                "mask": ("MASK", {}),
+                "image_format": (list(IU.IMAGE_FORMATS) + ["canvas"], {"default": "png", "tooltip": "(image/mask) Loop file format. webp lossless is smaller than png (metadata as EXIF, 16383 px max). raw keeps float values as is (no 8-bit quantization) and is memory-mapped on load, raw zstd (if zstandard is installed) compresses it. (image) canvas is chunked on disk for very large images : Image Crop/Paste only read and write the chunks they touch."}),
+                "batch_range": ("STRING", {"default": "", "tooltip": "(latent) Keep only a batch range, as start:stop. Empty for the whole batch."}),
+                "frame_range": ("STRING", {"default": "", "tooltip": "(video latent) Keep only a frame range, as start:stop. Only this window is read from the loop file."}),
+                "audio_mode": (["replace", "append"], {"default": "replace", "tooltip": "(audio) replace rewrites the whole flac file. append keeps a .audioloop folder of segments, Save Any appends its input as a new segment."}),
+                "context_seconds": ("FLOAT", {"default": 0.0, "min": 0.0, "max": 36000.0, "step": 0.1, "tooltip": "(audio append) Load only the last seconds of the track. 0 for the whole track."}),
+                "text_mode": (["file", "journal (latest)", "journal (all)", "lines", "typed"], {"default": "file", "tooltip": "(string) file rewrites the whole .txt file. typed saves strings, numbers and dicts as .json and loads them back with their type. journal keeps a .journal of records, Save Any appends its input as a new record. Load the latest record or all of them (one per line). lines returns the next line(s) of the .txt file on each execution."}),
+                "line_count": ("INT", {"default": 1, "min": 1, "max": 4096, "tooltip": "(string lines) Number of lines returned on each execution."}),
             },
             "hidden": {"id": "UNIQUE_ID"}
         }
@@ -209,7 +338,8 @@ class LoopAny:
     RETURN_NAMES = ("output", "path", "width", "height", "mask")
 
 
-    def loop_that_thing(self, input, loop_file, loop_mask, subfolder, id, mask=None, filename = "loop_file"):
+    @MM.timed("LoopAny", "input")
+    def loop_that_thing(self, input, loop_file, loop_mask, subfolder, id, mask=None, filename = "loop_file", batch_range="", frame_range="", image_format="png", audio_mode="replace", context_seconds=0.0, text_mode="file", line_count=1):
 
         w, h = 1, 1
         
@@ -218,21 +348,43 @@ class LoopAny:
         full_path = os.path.join(path, filename)
         
         match input:
+            # --- IMAGE (CANVAS) ---
+            case _ if image_format == "canvas" and (CU.is_canvas(input) or isinstance(input, torch.Tensor) and input.ndim == 4 and input.shape[1] != 4):
+                logger.debug("IMAGE CANVAS")
+                full_path += ".canvas"
+                WM.wait(full_path)
+
+                if os.path.exists(full_path) and loop_file:
+                    canvas = CU.open(full_path)
+                elif CU.is_canvas(input):
+                    canvas = CU.open(input.flush(full_path))
+                else:
+                    canvas = CU.create(input, full_path)
+
+                # a canvas has no alpha channel, the mask is passed at its own resolution :
+                # Image Crop reads it as resized to the canvas, only under the crop (crop_mask).
+                # Without mask, a blank mask of the canvas aspect ratio (1024 px at most, never full size)
+                scale = min(1.0, 1024 / max(canvas.width, canvas.height))
+                mask_out = mask if mask is not None else IU.get_default_mask(max(1, int(canvas.height * scale)), max(1, int(canvas.width * scale)))
+                return (canvas, full_path, canvas.width, canvas.height, mask_out)
+
             # --- IMAGE ---
             case _ if isinstance(input, torch.Tensor) and input.ndim == 4 and input.shape[1] != 4:
-                print("IMAGE TENSOR")
-                full_path += ".png"
+                logger.debug("IMAGE TENSOR")
+                full_path += IU.IMAGE_FORMATS.get(image_format, ".png")
+                WM.wait(full_path)
 
                 if os.path.exists(full_path) and loop_file:
-                    img_out = IU.load_existing_image(full_path)
+                    img_out = CM.get_or_load(full_path, IU.load_existing_image)
                 else:
-                    img_out = IU.save_new_image(input, full_path)
+                    img_out = IU.stored_value(input, full_path) # what a reload gives
+                    WM.write(full_path, IU.save_new_image, input, cache={"data": img_out.clone()}) # temp file + rename
 
                 _, h, w, _ = img_out.shape
 
                 if loop_mask:
                     mask_out = (
-                        IU.get_mask_from_image_alpha(full_path, h, w)
+                        CM.get_or_load(full_path, lambda p: IU.get_mask_from_image_alpha(p, h, w), "alpha")
                         if os.path.exists(full_path)
                         else IU.get_default_mask(h, w)
                     )
@@ -243,13 +395,15 @@ class LoopAny:
 
             # --- MASK ---
             case _ if isinstance(input, torch.Tensor) and input.ndim == 3:
-                print("MASK TENSOR")
-                full_path += ".png"
+                logger.debug("MASK TENSOR")
+                full_path += IU.IMAGE_FORMATS.get(image_format, ".png")
+                WM.wait(full_path)
 
                 if os.path.exists(full_path) and loop_file:
-                    mask_out = IU.load_existing_mask(full_path)
+                    mask_out = CM.get_or_load(full_path, IU.load_existing_mask)
                 else:
-                    mask_out = IU.save_new_mask(input, full_path)
+                    mask_out = IU.stored_value(input, full_path) # what a reload gives
+                    WM.write(full_path, IU.save_new_mask, input, cache={"data": mask_out.clone()}) # temp file + rename
 
                 w, h = IU.get_mask_size(mask_out)
 
@@ -261,51 +415,80 @@ class LoopAny:
                 latent_type = input.get("type", None)
                 # print("Checking LATENT : ", samples.mean(), samples.std())
                 full_path += ".latent"
+                WM.wait(full_path)
+                batch, frames = LU.parse_range(batch_range), LU.parse_range(frame_range)
                 if isinstance(samples, torch.Tensor):
                     s_ndim = getattr(samples, "ndim", None)
 
                     if s_ndim == 5 and samples.shape[1] == 16:
-                        print("LATENT (QWEN, WAN)")
-                        latent_out, w, h = LU.load_or_create_latent(input, full_path, loop_file)
+                        logger.debug("LATENT (QWEN, WAN)")
+                        latent_out, w, h = LU.load_or_create_latent(input, full_path, loop_file, batch, frames)
 
                     elif s_ndim == 4 and samples.shape[1] == 4:
-                        print("LATENT (SD 1.x / 2.x / SDXL)")
-                        latent_out, w, h = LU.load_or_create_latent(input, full_path, loop_file)
+                        logger.debug("LATENT (SD 1.x / 2.x / SDXL)")
+                        latent_out, w, h = LU.load_or_create_latent(input, full_path, loop_file, batch, frames)
                     
                     elif s_ndim == 4 and samples.shape[1] == 16:
-                        print("LATENT (Flux.1, SD3, Chroma)")
-                        latent_out, w, h = LU.load_or_create_latent(input, full_path, loop_file)
+                        logger.debug("LATENT (Flux.1, SD3, Chroma)")
+                        latent_out, w, h = LU.load_or_create_latent(input, full_path, loop_file, batch, frames)
 
                     elif s_ndim == 3 and latent_type == "audio":
-                        print("LATENT AUDIO (stable audio 1.0)")
+                        logger.debug("LATENT AUDIO (stable audio 1.0)")
                         latent_out = LU.load_or_create_audio_latent(input, full_path, loop_file)
 
                     elif s_ndim == 4 and latent_type == "audio":
-                        print("LATENT AUDIO (ACE Step)")
+                        logger.debug("LATENT AUDIO (ACE Step)")
                         latent_out = LU.load_or_create_audio_latent(input, full_path, loop_file)
         
                     else:
-                        print(f"LATENT AUDIO or Unknown LATENT (shape={samples.shape}, type={latent_type})")
-                        latent_out, w, h = LU.load_or_create_latent(input, full_path, loop_file)
+                        logger.debug(f"LATENT AUDIO or Unknown LATENT (shape={samples.shape}, type={latent_type})")
+                        latent_out, w, h = LU.load_or_create_latent(input, full_path, loop_file, batch, frames)
                         
                     return (latent_out, full_path, w, h, None)
                 else:
-                    print("LATENT (non-tensor samples)")
+                    logger.debug("LATENT (non-tensor samples)")
                     return (input, full_path, w, h, None)
 
             # --- AUDIO ---
+            case _ if isinstance(input, dict) and "waveform" in input and "sample_rate" in input and audio_mode == "append":
+                logger.debug("AUDIO (append)")
+                full_path += ".audioloop"
+                WM.wait(full_path)
+                audio_out = AU.load_or_create_audio_loop(input, full_path, loop_file, context_seconds)
+                return (audio_out, full_path, w, h, None)
+
             case _ if isinstance(input, dict) and "waveform" in input and "sample_rate" in input:
-                print("AUDIO")
+                logger.debug("AUDIO")
                 full_path += ".flac"
+                WM.wait(full_path)
                 audio_out = AU.load_or_create_audio(input, full_path, loop_file)
                 return (audio_out, full_path, w, h, None)
 
             # --- STRING OR INT/FLOAT ---
             case _ if isinstance(input, (str, dict, int, float)):
+                if text_mode == "typed":
+                    logger.debug(f"TYPED VALUE ({type(input).__name__})")
+                    full_path += ".json"
+                    WM.wait(full_path)
+                    value_out = SU.load_or_create_json_file(input, full_path, loop_file)
+                    return (value_out, full_path, w, h, None)
                 if isinstance(input, (dict, int, float)):
                     input = str(input)
-                print("STRING")
+                if text_mode.startswith("journal"):
+                    logger.debug("STRING (journal)")
+                    full_path += ".journal"
+                    WM.wait(full_path)
+                    string_out = SU.load_or_create_journal(input, full_path, loop_file, latest=text_mode == "journal (latest)")
+                    return (string_out, full_path, w, h, None)
+                if text_mode == "lines":
+                    logger.debug("STRING (lines)")
+                    full_path += ".txt"
+                    WM.wait(full_path)
+                    string_out = SU.load_or_create_lines(input, full_path, loop_file, line_count)
+                    return (string_out, full_path, w, h, None)
+                logger.debug("STRING")
                 full_path += ".txt"
+                WM.wait(full_path)
                 string_out = SU.load_or_create_text_file(input, full_path, loop_file)
                 return (string_out, full_path, w, h, None)
 
@@ -314,7 +497,7 @@ class LoopAny:
                 t = type(input)
                 module_name = t.__module__
                 type_name = t.__name__
-                print(f"[WARN] unexpected type : {module_name}.{type_name}")
+                logger.warning(f"Loop Any : unexpected type {module_name}.{type_name}")
                 return (input, full_path, w, h, None)
 
         return (input, path, w, h, mask)
@@ -340,12 +523,18 @@ class SaveAny:
             "required": {
                 "input": (IO.ANY, ),
                 "path": ("STRING", {"default": "/path/to/file.ext", "tooltip": "Full path of the saved file."}),
-                "save_steps": ("BOOLEAN", {"default": False, "tooltip": "Save a copy next to the saved image with a timestamp as suffix."}),
+                "save_steps": ("BOOLEAN", {"default": False, "tooltip": "Record the previous file as a step before saving, in a deduplicated history (.loop_steps folder). Rebuild steps with utils/loop_history_utils.py."}),
                 "save_metadata": ("BOOLEAN", {"default": False, "tooltip": "Save metadatas for compatible file formats."}),
                 "preview": ("BOOLEAN", {"default": True, "tooltip": "Display the preview in node."}),
             },
             "optional": {
-                "mask": ("MASK", {})
+                "mask": ("MASK", {}),
+                "async_write": ("BOOLEAN", {"default": False, "tooltip": "Write the file in background and return at once. LoopAny waits for the pending write of the same file before reading it."}),
+                "steps_keep": ("INT", {"default": 0, "min": 0, "max": 100000, "tooltip": "(save_steps) Number of last steps kept as is. 0 keeps every step."}),
+                "steps_thin": ("INT", {"default": 0, "min": 0, "max": 100000, "tooltip": "(save_steps) Keep one in steps_thin of the older steps. 0 deletes them."}),
+                "metadata_mode": (["text", "compressed", "reference"], {"default": "text", "tooltip": "(save_metadata) text : as ComfyUI does. compressed : zTXt png chunks, zlib in latent/audio metadata. reference : the workflow is written once to a .loop_metadata folder and files only store its name."}),
+                "compress_level": ("INT", {"default": 0, "min": 0, "max": 9, "tooltip": "(image/mask) Compression of .png (zlib level) and .webp (lossless effort) files. 0 is the fastest to write, 9 the smallest."}),
+                "typed_value": ("BOOLEAN", {"default": False, "tooltip": "(.json) Save strings as json values, for Loop Any typed text_mode. Numbers and dicts are always saved as json, other strings as plain text."}),
             },
             "hidden": {
                 "id": "UNIQUE_ID",
@@ -360,58 +549,91 @@ class SaveAny:
     RETURN_TYPES = ()
     OUTPUT_NODE = True
 
-    def save_that_thing(self, input, path, save_steps, save_metadata, preview, id, prompt=None, extra_pnginfo=None, mask=None):
+    @MM.timed("SaveAny", "input")
+    def save_that_thing(self, input, path, save_steps, save_metadata, preview, id, prompt=None, extra_pnginfo=None, mask=None, async_write=False, steps_keep=0, steps_thin=0, metadata_mode="text", compress_level=0, typed_value=False):
 
         type = "output"
         filename, subfolders, base = PU.parse_path(path, type)
+        folder = os.path.dirname(os.path.abspath(path)) # metadata reference folder
+
+        WM.check(path) # raise a failed background write of the previous execution
 
         if save_steps:
-            timestamp = f"{time.time():.6f}".replace(".", "")
-            name, ext = os.path.splitext(filename)
-            step_filename = f"{name}_{timestamp}{ext}"
-            step_path = os.path.join(base, subfolders, step_filename)
-            shutil.copy(path, step_path)
+            WM.wait(path)
+            HU.record_step(path, steps_keep, steps_thin) # only changed chunks are stored
 
         match input:
+            # --- IMAGE (CANVAS) ---
+            case _ if CU.is_canvas(input):
+                logger.debug(f"Saving CANVAS ({len(input.dirty)} dirty chunks)")
+                if not path.lower().endswith(".canvas"):
+                    raise ValueError(f"Save Any : a canvas is saved as a .canvas folder, not {os.path.basename(path)}. Connect Loop Any path (canvas image_format).")
+                WM.wait(path)
+                with MM.timer("loop_encode_seconds", file="canvas"):
+                    input.flush(path) # only dirty chunks are written
+                if preview:
+                    filename, file_path, _ = PM.acquire(folder_paths.get_temp_directory(), "loop_preview_", f"save{id}", ".jpeg")
+                    with open(file_path, "wb") as f:
+                        f.write(IU.encode_jpeg(IU.to_uint8(CU.open(path).overview())[0]))
+                    PM.commit(file_path)
+                    subfolders, type = "", "temp"
+
             # --- IMAGE ---
             case _ if isinstance(input, torch.Tensor) and input.ndim == 4 and input.shape[1] != 4:
-                metadata = IU.prepare_metadata(prompt, extra_pnginfo) if save_metadata else None
+                metadata = IU.prepare_metadata(prompt, extra_pnginfo, metadata_mode, folder) if save_metadata else None
                 if mask is not None:
-                    print(f"Saving IMAGE (with mask as alpha channel)")
-                    IU.save_image_with_alpha_mask(input, mask, path, metadata)
+                    logger.debug("Saving IMAGE (with mask as alpha channel)")
+                    cache = {"data": IU.stored_value(input, path)} # exactly what a reload gives
+                    if mask.ndim in (2, 3):
+                        b, h, w, _ = input.shape
+                        cache["alpha"] = IU.stored_value(IU.alpha_mask(mask, b, h, w), path, invert=True) # exactly what a reload gives
+                    alpha_mask = WM.snapshot(mask) if async_write else mask
+                    WM.write(path, lambda v, p: IU.save_image_with_alpha_mask(v, alpha_mask, p, metadata, compress_level), input, async_write, cache)
                 else:
-                    print(f"Saving IMAGE")
-                    IU.save_new_image(input, path, metadata)
+                    logger.debug("Saving IMAGE")
+                    WM.write(path, lambda v, p: IU.save_new_image(v, p, metadata, compress_level), input, async_write, {"data": IU.stored_value(input, path)})
 
             # --- MASK ---
             case _ if isinstance(input, torch.Tensor) and input.ndim == 3:
-                metadata = IU.prepare_metadata(prompt, extra_pnginfo) if save_metadata else None
-                print(f"Saving MASK")
-                IU.save_new_mask(input, path, metadata)
+                metadata = IU.prepare_metadata(prompt, extra_pnginfo, metadata_mode, folder) if save_metadata else None
+                logger.debug("Saving MASK")
+                WM.write(path, lambda v, p: IU.save_new_mask(v, p, metadata, compress_level), input, async_write, {"data": IU.stored_value(input, path)})
 
             # --- LATENT ---
             case _ if isinstance(input, dict) and "samples" in input:
                 samples = input["samples"]
                 if isinstance(samples, torch.Tensor):
-                    metadata = LU.prepare_metadata(prompt, extra_pnginfo) if save_metadata else None
-                    print(f"Saving LATENT")
-                    LU.save_new_latent(input, path, metadata)
+                    metadata = LU.prepare_metadata(prompt, extra_pnginfo, metadata_mode, folder) if save_metadata else None
+                    logger.debug("Saving LATENT")
+                    WM.write(path, lambda v, p: LU.save_new_latent(v, p, metadata), input, async_write, {"data": LU.stored_value(input)})
                     filename, subfolders, type = "latent.svg", "", "temp"
                 else:
-                    print("NOT SAVED - LATENT (non-tensor samples)")
+                    logger.warning("Save Any : NOT SAVED - LATENT (non-tensor samples)")
                     filename, subfolders, type = "error.svg", "", "temp"
                 
             # --- AUDIO ---
             case _ if isinstance(input, dict) and "waveform" in input and "sample_rate" in input:
-                metadata = AU.prepare_metadata(prompt, extra_pnginfo) if save_metadata else None
-                print("Saving AUDIO")
-                AU.save_audio(input, path, metadata)
+                metadata = AU.prepare_metadata(prompt, extra_pnginfo, metadata_mode, folder) if save_metadata else None
+                if path.endswith(".audioloop"):
+                    logger.debug("Appending AUDIO")
+                    WM.write(path, AU.append_audio, input, async_write, atomic=False)
+                else:
+                    logger.debug("Saving AUDIO")
+                    WM.write(path, lambda v, p: AU.save_audio(v, p, metadata), input, async_write)
                 filename, subfolders, type = "audio.svg", "", "temp"
 
             # --- STRING OR INT/FLOAT ---
             case _ if isinstance(input, (str, dict, int, float)):
-                print("Saving TEXT")
-                SU.save_text_file(input, path)
+                if path.endswith(".json"):
+                    typed = typed_value or not isinstance(input, str)
+                    logger.debug("Saving TYPED VALUE" if typed else "Saving TEXT (.json)")
+                    SU.write_json_file(input, path, async_write, typed) # cached as a reload gives it
+                elif path.endswith(".journal"):
+                    logger.debug("Appending TEXT record")
+                    WM.write(path, SU.append_record, input if isinstance(input, str) else str(input), async_write, atomic=False)
+                else:
+                    logger.debug("Saving TEXT")
+                    WM.write(path, SU.save_text_file, input if isinstance(input, str) else str(input), async_write)
                 filename, subfolders, type = "text.svg", "", "temp"
 
             # --- FALLBACK / UNEXPECTED TYPE ---
@@ -419,7 +641,7 @@ class SaveAny:
                 t = type(input)
                 module_name = t.__module__
                 type_name = t.__name__
-                print(f"NOT SAVED - unexpected type : {module_name}.{type_name}")
+                logger.warning(f"Save Any : NOT SAVED - unexpected type {module_name}.{type_name}")
                 filename, subfolders, type = "error.svg", "", "temp"
 
         if not preview:
@@ -0,0 +1,22 @@
+"""
+Run the package outside ComfyUI with the benchmark stand-ins (folder_paths, server, comfy, aiohttp), imported as comfyui_loop.
+Stand-ins only replace the modules that can't be imported.
+"""
+import os
+import sys
+import types
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "benchmarks", "stand_ins"))
+
+import folder_paths
+
+folder_paths.set_base_directory(tempfile.mkdtemp(prefix="loop-tests-"))
+for folder in (folder_paths.get_output_directory(), folder_paths.get_temp_directory()):
+    os.makedirs(folder, exist_ok=True)
+
+if "comfyui_loop" not in sys.modules:
+    package = types.ModuleType("comfyui_loop")
+    package.__path__ = [ROOT] # __init__ is not run, it copies preview icons into the ComfyUI tree
+    sys.modules["comfyui_loop"] = package
@@ -0,0 +1,22 @@
+import pytest
+import torch
+from comfyui_loop.utils.loop_audio_utils import LoopAudioUtils
+
+@pytest.mark.parametrize("channels", [1, 2, 6])
+@pytest.mark.parametrize("samples", [1, 65537])
+def test_save_audio_round_trip(tmp_path, channels, samples):
+    # a length of 1 mod FRAME_SAMPLES leaves a 1 sample final chunk
+    waveform = torch.rand(1, channels, samples) * 0.5 - 0.25
+    path = str(tmp_path / "audio.flac")
+    LoopAudioUtils.save_audio({"waveform": waveform, "sample_rate": 44100}, path)
+    audio = LoopAudioUtils.load_audio(path)
+    assert audio["sample_rate"] == 44100
+    assert audio["waveform"].shape == waveform.shape
+    assert (audio["waveform"] - waveform).abs().max() < 1e-3
+
+def test_save_any_creates_missing_audio_loop(tmp_path):
+    from comfyui_loop.nodes import SaveAny
+    path = str(tmp_path / "new.audioloop")
+    for _ in range(2):
+        SaveAny().save_that_thing({"waveform": torch.rand(1, 2, 800) * 0.1, "sample_rate": 8000}, path, False, False, False, "1")
+    assert LoopAudioUtils.read_index(path)["samples"] == 1600
@@ -0,0 +1,33 @@
+import os
+from comfyui_loop.utils.loop_history_utils import LoopHistoryUtils
+from comfyui_loop.utils.loop_path_utils import LoopPathUtils
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_record_step_batch_and_side_files(tmp_path):
+    path = str(tmp_path / "loop.webp")
+    write(path, b"first")
+    write(LoopPathUtils.batch_path(path, 1), b"second")
+    write(path + ".cursor", b"3")
+    assert LoopHistoryUtils.record_step(path) is not None
+    assert LoopHistoryUtils.record_step(path) is None # unchanged
+
+    write(LoopPathUtils.batch_path(path, 1), b"changed")
+    write(LoopPathUtils.batch_path(path, 2), b"third")
+    assert LoopHistoryUtils.record_step(path) is not None
+    assert len(LoopHistoryUtils.list_steps(path)) == 2
+
+    dest = LoopHistoryUtils.materialize(path, 0, str(tmp_path / "out.webp"))
+    assert read(dest) == b"first"
+    assert read(LoopPathUtils.batch_path(dest, 1)) == b"second"
+    assert read(dest + ".cursor") == b"3"
+    dest = LoopHistoryUtils.materialize(path, -1, dest)
+    assert read(LoopPathUtils.batch_path(dest, 2)) == b"third"
+    LoopHistoryUtils.materialize(path, 0, dest)
+    assert not os.path.exists(LoopPathUtils.batch_path(dest, 2)) # stale batch element removed
@@ -0,0 +1,79 @@
+import os
+import torch
+import folder_paths
+from comfyui_loop.nodes import LoopAny, SaveAny
+from comfyui_loop.utils.loop_cache_manager import cache_manager
+
+def loop_mask(filename, image_format="png"):
+    return LoopAny().loop_that_thing(torch.rand(1, 8, 8, 3), True, True, "", "1", filename=filename, image_format=image_format)[4]
+
+def test_alpha_cache_matches_reload():
+    for image_format, ext in (("png", ".png"), ("raw fp16", ".f16.npy")):
+        path = os.path.join(folder_paths.get_output_directory(), "alpha" + ext)
+        image, mask = torch.rand(3, 16, 16, 3), torch.rand(3, 8, 8)
+        SaveAny().save_that_thing(image, path, False, False, False, "1", mask=mask)
+        cached = loop_mask("alpha", image_format)
+        cache_manager.clear()
+        loaded = loop_mask("alpha", image_format)
+        assert cached.shape == loaded.shape == (3, 16, 16)
+        assert torch.equal(cached, loaded)
+
+def test_image_cache_matches_reload_and_is_not_shared():
+    for image_format, ext in (("png", ".png"), ("raw fp16", ".f16.npy")):
+        path = os.path.join(folder_paths.get_output_directory(), "shared" + ext)
+        image = torch.rand(2, 8, 8, 3)
+        SaveAny().save_that_thing(image, path, False, False, False, "1")
+        image.zero_() # the caller changes its tensor after saving
+        loop = lambda: LoopAny().loop_that_thing(torch.rand(1, 8, 8, 3), True, False, "", "1", filename="shared", image_format=image_format)[0]
+        cached = loop()
+        cached.fill_(2.0) # downstream in-place edit
+        hit = loop()
+        cache_manager.clear()
+        loaded = loop()
+        assert torch.equal(hit, loaded)
+
+def test_canvas_mask_keeps_input_resolution(tmp_path):
+    from PIL import Image
+    from comfyui_loop.utils.loop_img_utils import LoopImageUtils
+    mask = torch.zeros(1, 8, 8)
+    mask[:, :4] = 1.0
+    out = LoopAny().loop_that_thing(torch.rand(1, 64, 96, 3), True, False, "", "1", mask=mask, filename="canvas_mask", image_format="canvas")
+    assert out[4] is mask
+    path = str(tmp_path / "mask.png")
+    LoopImageUtils.save_preview_mask(mask, path, 0.5, (640, 960))
+    with Image.open(path) as img:
+        assert img.size == (480, 320)
+        alpha = img.getchannel("A")
+        assert alpha.getpixel((0, 0)) == 255 and alpha.getpixel((0, 319)) == 0
+
+def test_loop_any_create_writes_through_temp_file(monkeypatch):
+    from comfyui_loop.utils.loop_write_manager import write_manager
+    written = []
+    write_atomic = write_manager._write_atomic
+    monkeypatch.setattr(write_manager, "_write_atomic", lambda path, *args: written.append(path) or write_atomic(path, *args))
+    image = torch.rand(1, 8, 8, 3)
+    out = LoopAny().loop_that_thing(image, False, False, "", "1", filename="created")[0]
+    path = os.path.join(folder_paths.get_output_directory(), "created.png")
+    assert written == [path]
+    cache_manager.clear()
+    assert torch.equal(out, LoopAny().loop_that_thing(image, True, False, "", "1", filename="created")[0])
+
+def test_webp_keeps_metadata(tmp_path):
+    from PIL import Image
+    from comfyui_loop.utils.loop_img_utils import LoopImageUtils
+    for mode in ("text", "compressed"):
+        path = str(tmp_path / f"{mode}.webp")
+        metadata = LoopImageUtils.prepare_metadata({"1": {"inputs": {"text": "été"}}}, {"workflow": {"nodes": []}}, mode)
+        LoopImageUtils.save_new_image(torch.rand(1, 8, 8, 3), path, metadata)
+        with Image.open(path) as img:
+            exif = img.getexif()
+        assert exif[0x0110] == 'prompt:{"1": {"inputs": {"text": "\\u00e9t\\u00e9"}}}'
+        assert exif[0x010F] == 'workflow:{"nodes": []}'
+
+def test_canvas_default_mask_and_save_path(tmp_path):
+    import pytest
+    out = LoopAny().loop_that_thing(torch.rand(1, 64, 2048, 3), True, False, "", "1", filename="canvas_blank", image_format="canvas")
+    assert out[4].shape == (1, 32, 1024) and not out[4].any()
+    with pytest.raises(ValueError, match=".canvas"):
+        SaveAny().save_that_thing(out[0], str(tmp_path / "x.png"), False, False, False, "1")
+    assert not os.path.exists(tmp_path / "x.png")
@@ -0,0 +1,32 @@
+import os
+import torch
+import folder_paths
+from comfyui_loop.nodes import LoopAny, SaveAny
+from comfyui_loop.utils.loop_cache_manager import cache_manager
+
+def loop_latent(filename, batch_range=""):
+    latent = {"samples": torch.rand(1, 4, 8, 8)}
+    return LoopAny().loop_that_thing(latent, True, False, "", "1", filename=filename, batch_range=batch_range)[0]
+
+def test_latent_cache_matches_reload():
+    path = os.path.join(folder_paths.get_output_directory(), "latent.latent")
+    latent = {"samples": torch.rand(2, 4, 8, 8).half(), "noise_mask": torch.ones(2, 1, 8, 8), "batch_index": [0, 1]}
+    SaveAny().save_that_thing(latent, path, False, False, False, "1")
+    hit = loop_latent("latent")
+    cache_manager.clear()
+    loaded = loop_latent("latent")
+    assert list(hit) == list(loaded) == ["samples"]
+    assert hit["samples"].dtype == loaded["samples"].dtype == torch.float32
+    assert torch.equal(hit["samples"], loaded["samples"])
+
+def test_latent_window_copies_only_the_window(monkeypatch):
+    path = os.path.join(folder_paths.get_output_directory(), "video.latent")
+    SaveAny().save_that_thing({"samples": torch.rand(8, 4, 8, 8)}, path, False, False, False, "1")
+    copied = []
+    copy = cache_manager._copy
+    monkeypatch.setattr(cache_manager, "_copy", lambda value: copied.append(value) or copy(value))
+    window = loop_latent("video", "2:4")
+    assert window["samples"].shape == (2, 4, 8, 8)
+    assert copied[0]["samples"].shape == (2, 4, 8, 8)
+    window["samples"].fill_(5.0)
+    assert not torch.equal(loop_latent("video", "2:4")["samples"], window["samples"])
@@ -0,0 +1,57 @@
+import torch
+from comfyui_loop.utils.loop_preview_manager import LoopPreviewManager
+
+def test_pyramid_levels_are_built_on_request():
+    manager = LoopPreviewManager()
+    scales = manager.pyramid_scales(2000, 0.5)
+    described = manager.set_pyramid("1", torch.rand(2, 1000, 2000, 3), scales)
+    assert described["levels"][-1] == [2000, 1000]
+    assert not manager.pyramids["1"]["levels"]
+    data, etag = manager.pyramid_level("1", 0)
+    assert data[:2] == b"\xff\xd8" and list(manager.pyramids["1"]["levels"]) == [0]
+    assert manager.pyramid_level("1", len(scales)) is None
+
+def test_pyramid_memory_is_capped_in_bytes():
+    manager = LoopPreviewManager()
+    manager.MAX_PYRAMID_BYTES = 2 * 256 * 256 * 3 + 1000 # two 8-bit sources
+    for key in range(4):
+        manager.set_pyramid(key, torch.rand(1, 256, 256, 3), [1.0])
+    assert list(manager.pyramids) == ["2", "3"]
+    manager.pyramid_level("3", 0)
+    assert list(manager.pyramids) == ["3"] # the newest pyramid is always kept
+    assert manager.pyramid_bytes == manager.pyramids["3"]["bytes"]
+
+def test_cleanup_only_removes_loop_previews(tmp_path):
+    manager = LoopPreviewManager()
+    names = ["preview_1_0.jpeg", "mask_preview_1_0.png", "ComfyUI_temp_00001_.png", "loop_preview_3_0.txt"]
+    for name in names:
+        (tmp_path / name).write_bytes(b"x")
+    for prefix, ext in (("loop_preview_", ".jpeg"), ("loop_mask_preview_", ".png")):
+        _, file_path, _ = manager.acquire(str(tmp_path), prefix, "save12", ext)
+        with open(file_path, "wb") as f:
+            f.write(b"x")
+    manager.cleaned.clear()
+    manager.cleanup(str(tmp_path))
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(names)
+
+def test_pyramid_route_answers_conditional_requests():
+    import asyncio
+    import types
+    from aiohttp import web
+    manager = LoopPreviewManager()
+    manager.set_pyramid("5", torch.rand(1, 64, 64, 3), [0.5, 1.0])
+    request = lambda level, headers={}: types.SimpleNamespace(match_info={"node": "5", "level": level}, headers=headers)
+    response = asyncio.run(manager.handle_pyramid(request("1")))
+    assert isinstance(response, web.Response) and response.status == 200 and response.content_type == "image/jpeg"
+    cached = asyncio.run(manager.handle_pyramid(request("1", {"If-None-Match": response.headers["ETag"]})))
+    assert cached.status == 304 and cached.body is None
+    assert asyncio.run(manager.handle_pyramid(request("x"))).status == 400
+    assert asyncio.run(manager.handle_pyramid(request("2"))).status == 404
+
+def test_pyramid_source_is_an_accounted_copy():
+    manager = LoopPreviewManager()
+    image = torch.rand(4, 200, 300, 3)
+    manager.set_pyramid("7", image, [1.0])
+    source = manager.pyramids["7"]["source"]
+    assert source.base is None or source.base.nbytes == source.nbytes # owns its memory, not the batch
+    assert manager.pyramid_bytes == source.nbytes == 200 * 300 * 3
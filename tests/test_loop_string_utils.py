@@ -0,0 +1,52 @@
+import json
+import torch
+from comfyui_loop.nodes import SaveAny
+from comfyui_loop.utils.loop_string_utils import LoopStringUtils
+
+def test_save_any_json_string_is_plain_text(tmp_path):
+    path = str(tmp_path / "value.json")
+    SaveAny().save_that_thing('{"a": 1}', path, False, False, False, "1")
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == '{"a": 1}'
+
+def test_save_any_typed_values(tmp_path):
+    path = str(tmp_path / "value.json")
+    SaveAny().save_that_thing("hello", path, False, False, False, "1", typed_value=True)
+    assert LoopStringUtils.load_json_file(path) == "hello"
+    SaveAny().save_that_thing({"seed": 3}, path, False, False, False, "1")
+    assert LoopStringUtils.load_json_file(path) == {"seed": 3}
+
+def test_save_json_file_unserializable(tmp_path):
+    path = str(tmp_path / "value.json")
+    LoopStringUtils.save_json_file({"t": torch.zeros(2), "big": 2 ** 70}, path)
+    with open(path, encoding="utf-8") as f:
+        value = json.load(f)
+    assert value["big"] == 2 ** 70 and isinstance(value["t"], str)
+
+def test_typed_loop_with_plain_text_save():
+    from comfyui_loop.nodes import LoopAny
+    from comfyui_loop.utils.loop_cache_manager import cache_manager
+    loop = lambda: LoopAny().loop_that_thing("hello", True, False, "", "1", filename="typed", text_mode="typed")
+    value, path = loop()[:2]
+    assert value == "hello"
+    SaveAny().save_that_thing("world", path, False, False, False, "1")
+    assert loop()[0] == "world"
+    SaveAny().save_that_thing("42", path, False, False, False, "1")
+    hit = loop()[0]
+    cache_manager.clear()
+    assert hit == loop()[0] == 42
+
+def test_typed_value_cache_matches_reload():
+    from comfyui_loop.nodes import LoopAny
+    from comfyui_loop.utils.loop_cache_manager import cache_manager
+    loop = lambda value, load: LoopAny().loop_that_thing(value, load, False, "", "1", filename="typed_keys", text_mode="typed")[0]
+    created = loop({1: "a", "t": (1, 2)}, False)
+    hit = loop("", True)
+    cache_manager.clear()
+    assert created == hit == loop("", True) == {"1": "a", "t": [1, 2]}
+
+def test_save_any_creates_missing_journal(tmp_path):
+    path = str(tmp_path / "new.journal")
+    SaveAny().save_that_thing("first", path, False, False, False, "1")
+    SaveAny().save_that_thing("second", path, False, False, False, "1")
+    assert LoopStringUtils.read_records(path) == ["first", "second"]
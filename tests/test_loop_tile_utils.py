@@ -0,0 +1,13 @@
+import pytest
+import torch
+from comfyui_loop.utils.loop_tile_utils import LoopTileUtils
+
+def test_split_tiles_broadcasts_single_mask():
+    image, mask = torch.rand(4, 64, 64, 3), torch.rand(1, 32, 32)
+    tiles, mask_tiles, _ = LoopTileUtils.split_tiles(image, 32, 0, mask)
+    assert tiles.shape == (16, 32, 32, 3) and mask_tiles.shape == (16, 32, 32)
+    assert torch.equal(mask_tiles[:4], mask_tiles[12:])
+
+def test_split_tiles_rejects_mismatched_mask_batch():
+    with pytest.raises(ValueError, match="batch size"):
+        LoopTileUtils.split_tiles(torch.rand(4, 64, 64, 3), 32, 0, torch.rand(2, 64, 64))
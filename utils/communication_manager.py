@@ -1,62 +1,115 @@
 import asyncio
-import json
+import itertools
+import time
 from typing import Dict, Any
 from aiohttp import web
 from server import PromptServer
+from .loop_event_scheduler import event_scheduler
+from .loop_metrics_manager import metrics_manager
 
 class CommunicationManager:
+    """
+    Request/response messages with the frontend. Messages go through the event scheduler (coalesced per id),
+    responses can be posted one by one or batched as a list. Futures are removed by their last waiter,
+    or by a sweep once their deadline has passed, so none is left behind.
+    """
+
+    TIMEOUT = 30.0 # seconds
+
     def __init__(self):
         self.message_store = {}
-        self.response_callbacks = {}
+        self.response_callbacks = {} # message id -> {"future", "waiters", "deadline"}
+        self.counter = itertools.count(1)
         self.app = PromptServer.instance.app
         self.setup_routes()
-        
+
     def setup_routes(self):
         """
         Setup all communication routes
         """
         self.app.router.add_post('/api/bridge/response', self.handle_response)
-        
-    async def send_message(self, event_type: str, data: Dict[str, Any]) -> Dict[str, Any]:
+
+    def next_id(self) -> str:
+        """
+        Message id for messages without one : a process sequence number, unlike a hash it never collides.
+        """
+        return f"loop-{next(self.counter)}"
+
+    def sweep(self):
+        """
+        Cancel and remove the futures whose deadline has passed (their waiters are gone).
+        """
+        now = time.monotonic()
+        for message_id, callback in list(self.response_callbacks.items()):
+            if callback["deadline"] < now:
+                self.response_callbacks.pop(message_id, None)
+                if not callback["future"].done():
+                    callback["future"].cancel()
+                    metrics_manager.inc("loop_bridge_orphans_total")
+
+    async def send_message(self, event_type: str, data: Dict[str, Any], timeout: float = TIMEOUT) -> Dict[str, Any]:
         """
-        Send message to frontend and wait for response
+        Send message to frontend and wait for response.
+        A message with the id of a pending one replaces it before sending, and both callers get the same response.
         """
-        message_id = data.get('id', str(hash(json.dumps(data))))
-        
-        # Store callback for response
-        future = asyncio.Future()
-        self.response_callbacks[message_id] = future
-        
+        self.sweep()
+        message_id = str(data['id']) if 'id' in data else self.next_id()
+        data = {**data, 'id': message_id}
+
+        # Store callback for response, shared by the callers waiting for the same id
+        callback = self.response_callbacks.get(message_id)
+        if callback is None or callback["future"].done():
+            callback = {"future": asyncio.get_running_loop().create_future(), "waiters": 0, "deadline": 0.0}
+            self.response_callbacks[message_id] = callback
+        callback["waiters"] += 1
+        callback["deadline"] = max(callback["deadline"], time.monotonic() + timeout)
+
         # Send message to frontend
-        PromptServer.instance.send_sync(event_type, data)
-        
+        event_scheduler.post(event_type, message_id, data)
+
         # Wait for response with timeout
         try:
-            response = await asyncio.wait_for(future, timeout=30.0)
-            return response
+            return await asyncio.wait_for(asyncio.shield(callback["future"]), timeout=timeout)
         except asyncio.TimeoutError:
             raise Exception(f"Timeout waiting for response for message {message_id}")
         finally:
-            self.response_callbacks.pop(message_id, None)
-    
+            callback["waiters"] -= 1
+            if callback["waiters"] == 0 and self.response_callbacks.get(message_id) is callback:
+                self.response_callbacks.pop(message_id, None)
+                if not callback["future"].done():
+                    callback["future"].cancel()
+                    metrics_manager.inc("loop_bridge_orphans_total")
+
+    def resolve(self, data: Dict[str, Any]) -> bool:
+        """
+        Resolve the future of a response. Return False for an unknown (or expired) message id.
+        """
+        callback = self.response_callbacks.get(str(data.get('id')))
+        if callback is None:
+            return False
+        if not callback["future"].done():
+            callback["future"].set_result(data)
+        return True
+
     async def handle_response(self, request):
         """
-        Handle response from frontend
+        Handle response from frontend : a response object, or a list of them (batched responses)
         """
         try:
             data = await request.json()
-            message_id = data.get('id')
-            
-            if message_id in self.response_callbacks:
-                future = self.response_callbacks[message_id]
-                if not future.done():
-                    future.set_result(data)
+            self.sweep()
+
+            if isinstance(data, list):
+                unknown = [str(item.get('id')) for item in data if not self.resolve(item)]
+                return web.json_response({"status": "ok", "resolved": len(data) - len(unknown), "unknown": unknown})
+
+            if self.resolve(data):
                 return web.json_response({"status": "ok"})
             else:
                 return web.json_response({"status": "error", "message": "Unknown message ID"}, status=400)
-                
+
         except Exception as e:
             return web.json_response({"status": "error", "message": str(e)}, status=500)
 
 # Global instance
-comm_manager = CommunicationManager()
\ No newline at end of file
+comm_manager = CommunicationManager()
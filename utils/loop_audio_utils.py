@@ -1,61 +1,221 @@
 import os
+import shutil
 import torch
-import torchaudio
-from torchaudio.functional import resample
+from torchaudio.transforms import Resample
+from functools import lru_cache
 import json
 import av
-import io
+from .loop_cache_manager import cache_manager
+from .loop_write_manager import write_manager
+from .loop_path_utils import LoopPathUtils
+from .loop_metadata_utils import LoopMetadataUtils
 
 class LoopAudioUtils:
     """Utility class for managing audio files"""
 
     DEFAULT_SAMPLE_RATE = 44100
+    FRAME_SAMPLES = 1 << 16 # samples per channel encoded at once, bounds the memory used by save_audio
 
     @staticmethod
-    def load_or_create_audio(audio: dict | None, path: str, load: bool = True, target_sample_rate: int = DEFAULT_SAMPLE_RATE) -> dict:
+    def load_or_create_audio(audio: dict | None, path: str, load: bool = True, target_sample_rate: int | None = None) -> dict:
         """
-        Load an existing audio file or create the file.
+        Load an existing audio file or create the file. Files keep their native sample rate,
+        loaded audio is resampled only if target_sample_rate is given (memoized per file version).
         """
         if os.path.exists(path) and load:
-            return LoopAudioUtils.load_audio(path, target_sample_rate)
+            audio = cache_manager.get_or_load(path, LoopAudioUtils.load_audio)
+            if target_sample_rate and audio["sample_rate"] != target_sample_rate:
+                native = audio
+                audio = cache_manager.get_or_load(
+                    path,
+                    lambda p: {"waveform": LoopAudioUtils.resample(native["waveform"], native["sample_rate"], target_sample_rate), "sample_rate": target_sample_rate},
+                    f"rate:{target_sample_rate}",
+                )
+            return audio
         else:
             if audio is None:
-                waveform = torch.zeros((1, 1, target_sample_rate), dtype=torch.float32)
-                audio = {"waveform": waveform, "sample_rate": target_sample_rate}
-            LoopAudioUtils.save_audio(audio, path)
+                sample_rate = target_sample_rate or LoopAudioUtils.DEFAULT_SAMPLE_RATE
+                waveform = torch.zeros((1, 1, sample_rate), dtype=torch.float32)
+                audio = {"waveform": waveform, "sample_rate": sample_rate}
+            write_manager.write(path, LoopAudioUtils.save_audio, audio)
             return audio
 
     @staticmethod
-    def load_audio(path: str, target_sample_rate: int = DEFAULT_SAMPLE_RATE) -> dict:
+    def load_audio(path: str, target_sample_rate: int | None = None) -> dict:
         """
         Load an existing audio file and return a dict with 'waveform' and 'sample_rate'.
-        eventually resample to target_sample_rate.
+        eventually resample to target_sample_rate (default : native sample rate).
         """
-        waveform, sample_rate = torchaudio.load(path)
-        if waveform.ndim == 2:
-            waveform = waveform.unsqueeze(0)
-        if sample_rate != target_sample_rate:
-            waveform = resample(waveform, sample_rate, target_sample_rate)
+        waveform, sample_rate = LoopAudioUtils.decode_audio(path)
+        waveform = waveform.unsqueeze(0)
+        if target_sample_rate and sample_rate != target_sample_rate:
+            waveform = LoopAudioUtils.resample(waveform, sample_rate, target_sample_rate)
             sample_rate = target_sample_rate
         return {"waveform": waveform, "sample_rate": sample_rate}
 
-    # @staticmethod
-    # def save_audio(audio: dict, path: str, metadata: dict | None = None) -> str:
-    #     """
-    #     Save an audio file as wav and return input path.
-    #     """
-    #     waveform = audio["waveform"]
-    #     sample_rate = audio["sample_rate"]
-    #     if waveform.ndim == 3:
-    #         waveform = waveform[0]
-    #     os.makedirs(os.path.dirname(path), exist_ok=True)
-    #     torchaudio.save(path, waveform.cpu(), sample_rate)
-    #     return path
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _resampler(orig_sample_rate: int, target_sample_rate: int, dtype: torch.dtype, device: str) -> Resample:
+        """
+        Return a resampler, its sinc kernel is built once per (orig, target, dtype, device).
+        """
+        return Resample(orig_sample_rate, target_sample_rate, dtype=dtype).to(device)
+
+    @staticmethod
+    def resample(waveform: torch.Tensor, orig_sample_rate: int, target_sample_rate: int) -> torch.Tensor:
+        """
+        Resample a float waveform (..., samples) with a cached resampler.
+        """
+        if orig_sample_rate == target_sample_rate:
+            return waveform
+        resampler = LoopAudioUtils._resampler(int(orig_sample_rate), int(target_sample_rate), waveform.dtype, str(waveform.device))
+        with torch.no_grad():
+            return resampler(waveform)
+
+    @staticmethod
+    def load_or_create_audio_loop(audio: dict, path: str, load: bool = True, context_seconds: float = 0.0) -> dict:
+        """
+        Load an append-mode audio loop (.audioloop folder) or create it with audio as first segment.
+        context_seconds > 0 loads only the last seconds of the track.
+        """
+        if not (os.path.exists(path) and load):
+            LoopAudioUtils.create_audio_loop(audio, path)
+        index_path = os.path.join(path, "index.json")
+        return cache_manager.get_or_load(
+            index_path,
+            lambda p: LoopAudioUtils.load_audio_loop(path, context_seconds),
+            f"context:{context_seconds}",
+        )
+
+    @staticmethod
+    def read_index(path: str) -> dict:
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def write_index(path: str, index: dict):
+        """
+        Atomically replace the index of an audio loop, segments written before it are ignored until then.
+        """
+        index_path = os.path.join(path, "index.json")
+        tmp = LoopPathUtils.temp_path(index_path)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f)
+        os.replace(tmp, index_path)
+
+    @staticmethod
+    def create_audio_loop(audio: dict, path: str):
+        """
+        Create (or replace) an audio loop folder holding audio as its first segment.
+        """
+        waveform = audio["waveform"]
+        channels = waveform.shape[-2]
+        tmp = LoopPathUtils.temp_path(path)
+        os.makedirs(tmp)
+        try:
+            LoopAudioUtils.write_index(tmp, {"sample_rate": audio["sample_rate"], "channels": channels, "samples": 0, "segments": []})
+            LoopAudioUtils.append_audio(audio, tmp)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    @staticmethod
+    def append_audio(audio: dict, path: str) -> str:
+        """
+        Append audio to an audio loop as a new flac segment, then update its index. Cost depends only on the new samples.
+        audio is resampled to the loop sample rate, mono is expanded to the loop channels.
+        A missing loop (folder or index) is created with audio as first segment.
+        """
+        if not os.path.exists(os.path.join(path, "index.json")):
+            LoopAudioUtils.create_audio_loop(audio, path)
+            return path
+        index = LoopAudioUtils.read_index(path)
+        waveform = audio["waveform"]
+        if waveform.ndim == 3:
+            waveform = waveform[0]
+        if audio["sample_rate"] != index["sample_rate"]:
+            waveform = LoopAudioUtils.resample(waveform, audio["sample_rate"], index["sample_rate"])
+        if waveform.shape[0] != index["channels"]:
+            if waveform.shape[0] != 1:
+                raise ValueError(f"Can't append {waveform.shape[0]} channels audio to a {index['channels']} channels audio loop.")
+            waveform = waveform.expand(index["channels"], -1)
+
+        samples = waveform.shape[1]
+        if samples == 0:
+            return path
+        segment = f"segment_{len(index['segments']):05d}.flac"
+        segment_path = os.path.join(path, segment)
+        tmp = LoopPathUtils.temp_path(segment_path)
+        LoopAudioUtils.save_audio({"waveform": waveform, "sample_rate": index["sample_rate"]}, tmp)
+        os.replace(tmp, segment_path)
+
+        index["segments"].append({"file": segment, "offset": index["samples"], "samples": samples})
+        index["samples"] += samples
+        LoopAudioUtils.write_index(path, index)
+        return path
+
+    @staticmethod
+    def load_audio_loop(path: str, context_seconds: float = 0.0) -> dict:
+        """
+        Load a whole audio loop, or only its last context_seconds, decoding only the segments needed.
+        """
+        index = LoopAudioUtils.read_index(path)
+        sample_rate, total = index["sample_rate"], index["samples"]
+        start = max(0, total - int(context_seconds * sample_rate)) if context_seconds > 0 else 0
+
+        waveform = torch.zeros((index["channels"], total - start), dtype=torch.float32)
+        for segment in index["segments"]:
+            end = segment["offset"] + segment["samples"]
+            if end <= start:
+                continue
+            data, _ = LoopAudioUtils.decode_audio(os.path.join(path, segment["file"]))
+            skip = max(0, start - segment["offset"])
+            data = data[:, skip:segment["samples"]]
+            offset = segment["offset"] + skip - start
+            waveform[:, offset:offset + data.shape[1]] = data
+
+        return {"waveform": waveform.unsqueeze(0), "sample_rate": sample_rate}
+
+    @staticmethod
+    def decode_audio(path: str) -> tuple[torch.Tensor, int]:
+        """
+        Decode the first audio stream of a file frame by frame into a preallocated (channels, samples) float tensor.
+        Return the waveform and its sample rate.
+        """
+        with av.open(path) as container:
+            stream = container.streams.audio[0]
+            sample_rate = stream.rate
+            channels = stream.channels
+            resampler = av.AudioResampler(format="fltp", layout=stream.layout, rate=sample_rate) # planar float, same rate
+
+            # sample count from the stream header (flac STREAMINFO), grown if missing or wrong
+            total = 0
+            if stream.duration is not None and stream.time_base is not None:
+                total = int(stream.duration * stream.time_base * sample_rate)
+            waveform = torch.empty((channels, max(total, LoopAudioUtils.FRAME_SAMPLES)), dtype=torch.float32)
+
+            offset = 0
+            for frame in container.decode(stream):
+                for converted in resampler.resample(frame):
+                    data = torch.from_numpy(converted.to_ndarray())
+                    n = data.shape[1]
+                    if offset + n > waveform.shape[1]:
+                        grown = torch.empty((channels, max(offset + n, waveform.shape[1] * 2)), dtype=torch.float32)
+                        grown[:, :offset] = waveform[:, :offset]
+                        waveform = grown
+                    waveform[:, offset:offset + n] = data
+                    offset += n
+
+        return waveform[:, :offset], sample_rate
 
     @staticmethod
     def save_audio(audio: dict, path: str, metadata: dict | None = None) -> str:
         """
         Save an audio file as flac (mono to up to 6 channels). return input path.
+        Encoded in frames of FRAME_SAMPLES straight to the file, only one frame is interleaved at a time.
         """
         waveform = audio["waveform"]
         sample_rate = audio["sample_rate"]
@@ -63,7 +223,7 @@ class LoopAudioUtils:
         if waveform.ndim == 3:
             waveform = waveform[0]  # Shape: (channels, samples)
         
-        num_channels = waveform.shape[0]
+        num_channels, num_samples = waveform.shape
         
         # layout
         if num_channels == 1:
@@ -72,46 +232,31 @@ class LoopAudioUtils:
             layout = 'stereo'
         else:
             layout = f'{num_channels}.0'  # up to 6 channels
-        
-        # Transform for PyAV
-        if num_channels == 1:
-            frame_tensor = waveform  # (1, samples)
-        else:
-            frame_tensor = waveform.movedim(0, 1).reshape(1, -1) # (channels, samples) → (1, samples * channels)
 
-        frame_data = frame_tensor.cpu().numpy()
-        
-        output_buffer = io.BytesIO()
-        output_container = av.open(output_buffer, mode='w', format="flac")
-        
-        if metadata:
-            for key, value in metadata.items():
-                output_container.metadata[key] = str(value)
-        
-        out_stream = output_container.add_stream("flac", rate=sample_rate)
-        
-        frame = av.AudioFrame.from_ndarray(frame_data, format='flt', layout=layout)
-        frame.sample_rate = sample_rate
-        frame.pts = 0
-        
-        output_container.mux(out_stream.encode(frame))
-        output_container.mux(out_stream.encode(None))
-        output_container.close()
+        with av.open(path, mode='w', format="flac") as output_container:
+            if metadata:
+                for key, value in metadata.items():
+                    output_container.metadata[key] = str(value)
+
+            out_stream = output_container.add_stream("flac", rate=sample_rate, layout=layout)
+
+            for start in range(0, num_samples, LoopAudioUtils.FRAME_SAMPLES):
+                chunk = waveform[:, start:start + LoopAudioUtils.FRAME_SAMPLES]
+                # (channels, n) → (1, n * channels) interleaved
+                frame_data = chunk.movedim(0, 1).reshape(1, -1).to("cpu", torch.float32).contiguous().numpy() # a 1 sample chunk reshapes to a strided view
+
+                frame = av.AudioFrame.from_ndarray(frame_data, format='flt', layout=layout)
+                frame.sample_rate = sample_rate
+                frame.pts = start
+                output_container.mux(out_stream.encode(frame))
+
+            output_container.mux(out_stream.encode(None))
 
-        with open(path, 'wb') as f:
-            f.write(output_buffer.getbuffer())
-        
         return path
 
     @staticmethod
-    def prepare_metadata(prompt: str, extra_pnginfo: str) -> dict[str, str]:
+    def prepare_metadata(prompt: str, extra_pnginfo: str, mode: str = "text", folder: str | None = None) -> dict[str, str]:
         """
-        Feed a dict with metadata.
+        Feed a dict with metadata (see LoopMetadataUtils for modes).
         """
-        metadata = {}
-        if prompt is not None:
-            metadata["prompt"] = json.dumps(prompt)
-        if extra_pnginfo is not None:
-            for x in extra_pnginfo:
-                metadata[x] = json.dumps(extra_pnginfo[x])
-        return metadata
+        return LoopMetadataUtils.text_metadata(prompt, extra_pnginfo, mode, folder)
@@ -0,0 +1,162 @@
+import os
+import threading
+from collections import OrderedDict
+import torch
+from .loop_metrics_manager import metrics_manager
+
+class LoopCacheManager:
+    """
+    Process-wide, write-through cache of loop file contents, keyed by absolute path.
+    SaveAny fills it after each write, LoopAny reads from it instead of decoding the file again.
+    Entries are validated against the file (mtime, size, inode) so external edits always win.
+    Cached tensors are never shared with callers : put stores a copy and get returns one, so in-place edits downstream
+    can't change the cache.
+    """
+
+    DEFAULT_MAX_BYTES = 4 * 1024 ** 3 # 4 GiB of cached tensors
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # path -> {"sig": ..., "values": {kind: value}, "bytes": int}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    @staticmethod
+    def _signature(path: str) -> tuple | None:
+        """
+        Return the (mtime, size, inode) signature of a file, or None if it doesn't exist.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    @staticmethod
+    def _sizeof(value) -> int:
+        """
+        Approximate the memory held by a cached value (tensors, dicts of tensors, strings).
+        """
+        if isinstance(value, torch.Tensor):
+            return value.element_size() * value.nelement()
+        if isinstance(value, dict):
+            return sum(LoopCacheManager._sizeof(v) for v in value.values())
+        if isinstance(value, (list, tuple)):
+            return sum(LoopCacheManager._sizeof(v) for v in value)
+        if isinstance(value, (str, bytes)):
+            return len(value)
+        return 64
+
+    @staticmethod
+    def _copy(value):
+        """
+        Copy tensors (recursively in dicts, lists and tuples), other values are immutable or returned as is.
+        """
+        if isinstance(value, torch.Tensor):
+            return value.detach().clone()
+        if isinstance(value, dict):
+            return {k: LoopCacheManager._copy(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return type(value)(LoopCacheManager._copy(v) for v in value)
+        return value
+
+    def get(self, path: str, kind: str = "data", select=None):
+        """
+        Return the cached value of path for the given kind, or None on a miss or a stale entry.
+        select(value) picks a part of the value (e.g. views of a window) before it is copied, so only that part is copied.
+        """
+        key = self._key(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or kind not in entry["values"]:
+                self.misses += 1
+                metrics_manager.inc("loop_cache_requests_total", result="miss")
+                return None
+            if entry["sig"] != self._signature(key):
+                self._drop(key)
+                self.misses += 1
+                metrics_manager.inc("loop_cache_requests_total", result="stale")
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            metrics_manager.inc("loop_cache_requests_total", result="hit")
+            value = entry["values"][kind]
+        return self._copy(select(value) if select is not None else value)
+
+    def put(self, path: str, value, kind: str = "data", copy: bool = True):
+        """
+        Store value for path. Must be called right after the file was written or read.
+        Other kinds of the same path are kept only if the file didn't change since they were stored.
+        copy=False : the cache takes ownership of value, the caller must not use (or change) it afterwards.
+        """
+        key = self._key(path)
+        sig = self._signature(key)
+        if sig is None or value is None:
+            return
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            self.invalidate(key)
+            return
+        if copy:
+            value = self._copy(value)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry["sig"] != sig:
+                self._drop(key)
+                entry = {"sig": sig, "values": {}, "bytes": 0}
+                self.entries[key] = entry
+            if kind in entry["values"]:
+                entry["bytes"] -= self._sizeof(entry["values"][kind])
+                self.total_bytes -= self._sizeof(entry["values"][kind])
+            entry["values"][kind] = value
+            entry["bytes"] += size
+            self.total_bytes += size
+            self.entries.move_to_end(key)
+            self._evict()
+
+    def get_or_load(self, path: str, loader, kind: str = "data"):
+        """
+        Return the cached value of path, or load it with loader(path) and cache it.
+        """
+        value = self.get(path, kind)
+        if value is None:
+            file_type = metrics_manager.file_type(path)
+            with metrics_manager.timer("loop_decode_seconds", file=file_type):
+                value = loader(path)
+            metrics_manager.inc("loop_read_bytes_total", metrics_manager.file_size(path), file=file_type)
+            self.put(path, value, kind)
+        return value
+
+    def invalidate(self, path: str):
+        """
+        Forget every cached value of path.
+        """
+        with self.lock:
+            self._drop(self._key(path))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def _drop(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry["bytes"]
+
+    def _evict(self):
+        """
+        Evict least recently used entries until the byte budget is respected.
+        """
+        while self.total_bytes > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            self._drop(key)
+
+# Global instance
+cache_manager = LoopCacheManager()
@@ -0,0 +1,189 @@
+import os
+import json
+import math
+import shutil
+import numpy as np
+import torch
+import torch.nn.functional as F
+from .loop_path_utils import LoopPathUtils
+
+class LoopCanvas:
+    """
+    Handle on a chunked on-disk image canvas (.canvas folder), flowing through the graph instead of an IMAGE tensor.
+    Only the chunks under a crop rectangle are read. Pasted chunks are kept in memory (copy-on-write)
+    until SaveAny writes them back, so memory and I/O per iteration scale with the crop size, not the canvas size.
+    """
+
+    def __init__(self, path: str, meta: dict, dirty: dict | None = None):
+        self.path = path
+        self.meta = meta
+        self.dirty = dict(dirty or {}) # (row, column) -> uint8 tensor (chunk, chunk, C)
+
+    @property
+    def height(self) -> int:
+        return self.meta["height"]
+
+    @property
+    def width(self) -> int:
+        return self.meta["width"]
+
+    @property
+    def shape(self) -> tuple:
+        """
+        IMAGE-like shape (1, H, W, C)
+        """
+        return (1, self.meta["height"], self.meta["width"], self.meta["channels"])
+
+    def _chunks(self, mode: str = "r") -> np.memmap:
+        return np.load(os.path.join(self.path, "chunks.npy"), mmap_mode=mode)
+
+    def _chunk(self, chunks: np.memmap, r: int, c: int) -> torch.Tensor:
+        """
+        Return a chunk as uint8 tensor, from memory if dirty or from disk.
+        """
+        chunk = self.dirty.get((r, c))
+        return chunk if chunk is not None else torch.from_numpy(np.array(chunks[r, c]))
+
+    def read(self, x: int, y: int, w: int, h: int) -> torch.Tensor:
+        """
+        Read a rectangle of the canvas as IMAGE tensor (1, h, w, C) in [0, 1], touching only the chunks under it.
+        """
+        cs = self.meta["chunk"]
+        r0, r1 = y // cs, (y + h - 1) // cs
+        c0, c1 = x // cs, (x + w - 1) // cs
+
+        chunks = self._chunks()
+        block = torch.from_numpy(np.array(chunks[r0:r1 + 1, c0:c1 + 1])) # (rows, cols, cs, cs, C)
+        for (r, c), chunk in self.dirty.items():
+            if r0 <= r <= r1 and c0 <= c <= c1:
+                block[r - r0, c - c0] = chunk
+        block = block.permute(0, 2, 1, 3, 4).reshape((r1 - r0 + 1) * cs, (c1 - c0 + 1) * cs, -1)
+
+        oy, ox = y - r0 * cs, x - c0 * cs
+        return block[oy:oy + h, ox:ox + w].float().div_(255.0).unsqueeze(0)
+
+    def write(self, x: int, y: int, region: torch.Tensor) -> "LoopCanvas":
+        """
+        Return a new canvas with region (h, w, C) in [0, 1] written at x, y. The canvas itself is unchanged.
+        """
+        cs = self.meta["chunk"]
+        h, w = region.shape[:2]
+        region = LoopCanvasUtils.to_uint8(region)
+
+        chunks = self._chunks()
+        dirty = dict(self.dirty)
+        for r in range(y // cs, (y + h - 1) // cs + 1):
+            for c in range(x // cs, (x + w - 1) // cs + 1):
+                # intersection of the region and the chunk, in canvas coordinates
+                ty0, ty1 = max(y, r * cs), min(y + h, (r + 1) * cs)
+                tx0, tx1 = max(x, c * cs), min(x + w, (c + 1) * cs)
+                chunk = self._chunk(chunks, r, c).clone()
+                chunk[ty0 - r * cs:ty1 - r * cs, tx0 - c * cs:tx1 - c * cs] = region[ty0 - y:ty1 - y, tx0 - x:tx1 - x]
+                dirty[(r, c)] = chunk
+        return LoopCanvas(self.path, self.meta, dirty)
+
+    def overview(self) -> torch.Tensor:
+        """
+        Return the downscaled overview of the canvas (dirty chunks included) as IMAGE tensor (1, oh, ow, C).
+        """
+        cs, f = self.meta["chunk"], self.meta["overview_factor"]
+        overview = torch.from_numpy(np.array(np.load(os.path.join(self.path, "overview.npy"))))
+        for (r, c), chunk in self.dirty.items():
+            block = LoopCanvasUtils.pool(chunk, f)
+            overview[r * cs // f:(r + 1) * cs // f, c * cs // f:(c + 1) * cs // f] = block
+        oh, ow = math.ceil(self.height / f), math.ceil(self.width / f)
+        return overview[:oh, :ow].float().div_(255.0).unsqueeze(0)
+
+    def flush(self, path: str | None = None) -> str:
+        """
+        Write dirty chunks (and their overview blocks) to the canvas at path (default : its own path). Return path.
+        Writing to another path copies the canvas first.
+        """
+        path = path or self.path
+        if os.path.abspath(path) != os.path.abspath(self.path):
+            tmp = LoopPathUtils.temp_path(path)
+            shutil.copytree(self.path, tmp)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(tmp, path)
+
+        if self.dirty:
+            cs, f = self.meta["chunk"], self.meta["overview_factor"]
+            chunks = np.load(os.path.join(path, "chunks.npy"), mmap_mode="r+")
+            overview = np.load(os.path.join(path, "overview.npy"), mmap_mode="r+")
+            for (r, c), chunk in self.dirty.items():
+                chunks[r, c] = chunk.numpy()
+                overview[r * cs // f:(r + 1) * cs // f, c * cs // f:(c + 1) * cs // f] = LoopCanvasUtils.pool(chunk, f).numpy()
+            chunks.flush()
+            overview.flush()
+            del chunks, overview
+        return path
+
+class LoopCanvasUtils:
+    """Utility class for chunked image canvases"""
+
+    CHUNK = 512
+    OVERVIEW_DIM = 2048 # max overview side
+
+    @staticmethod
+    def to_uint8(tensor: torch.Tensor) -> torch.Tensor:
+        """
+        Quantize [0, 1] values to uint8 with rounding, so unchanged pixels survive a read/write round trip.
+        """
+        return (tensor.detach().float().clamp(0.0, 1.0) * 255).round_().to(torch.uint8).cpu()
+
+    @staticmethod
+    def pool(chunk: torch.Tensor, factor: int) -> torch.Tensor:
+        """
+        Box-downscale a uint8 chunk (cs, cs, C) by an integer factor.
+        """
+        if factor == 1:
+            return chunk
+        pooled = F.avg_pool2d(chunk.permute(2, 0, 1).float().unsqueeze(0), factor)[0].permute(1, 2, 0)
+        return pooled.round_().to(torch.uint8)
+
+    @staticmethod
+    def is_canvas(value) -> bool:
+        return isinstance(value, LoopCanvas)
+
+    @staticmethod
+    def open(path: str) -> LoopCanvas:
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return LoopCanvas(path, meta)
+
+    @staticmethod
+    def create(image: torch.Tensor, path: str, chunk: int = CHUNK) -> LoopCanvas:
+        """
+        Write an IMAGE tensor (first batch element) as a new canvas at path, replacing any existing one.
+        Chunks are written one chunk row at a time.
+        """
+        _, h, w, c = image.shape
+        rows, columns = math.ceil(h / chunk), math.ceil(w / chunk)
+        factor = 1
+        while max(h, w) / factor > LoopCanvasUtils.OVERVIEW_DIM and factor < chunk:
+            factor *= 2
+        meta = {"height": h, "width": w, "channels": c, "chunk": chunk, "rows": rows, "columns": columns, "overview_factor": factor}
+
+        tmp = LoopPathUtils.temp_path(path)
+        os.makedirs(tmp)
+        try:
+            chunks = np.lib.format.open_memmap(os.path.join(tmp, "chunks.npy"), mode="w+", dtype=np.uint8, shape=(rows, columns, chunk, chunk, c))
+            overview = np.lib.format.open_memmap(os.path.join(tmp, "overview.npy"), mode="w+", dtype=np.uint8, shape=(rows * chunk // factor, columns * chunk // factor, c))
+            for r in range(rows):
+                strip = LoopCanvasUtils.to_uint8(image[0, r * chunk:(r + 1) * chunk])
+                strip = F.pad(strip.permute(2, 0, 1), (0, columns * chunk - w, 0, chunk - strip.shape[0])).permute(1, 2, 0)
+                chunks[r] = strip.reshape(chunk, columns, chunk, c).permute(1, 0, 2, 3).numpy()
+                overview[r * chunk // factor:(r + 1) * chunk // factor] = LoopCanvasUtils.pool(strip, factor).numpy()
+            chunks.flush()
+            overview.flush()
+            del chunks, overview
+            with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.replace(tmp, path)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return LoopCanvas(path, meta)
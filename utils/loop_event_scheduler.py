@@ -0,0 +1,82 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from server import PromptServer
+from .loop_metrics_manager import metrics_manager
+
+logger = logging.getLogger(__name__)
+
+class LoopEventScheduler:
+    """
+    Websocket events to the frontend, coalesced and rate limited.
+    Pending events are keyed by (event, key), e.g. a node id : a newer event replaces the pending one (latest wins),
+    so a fast loop never queues previews the browser can't render in time. The last event of a key is always sent.
+    Each client (sid, None for broadcasts) gets RATE events per second, with bursts of BURST events.
+    Events are sent by a single background thread, post() never blocks the caller.
+    """
+
+    RATE = 10.0 # events per second and client
+    BURST = 4
+
+    def __init__(self):
+        self.pending = OrderedDict() # (event, key) -> (data, sid), oldest first
+        self.buckets = {} # sid -> [tokens, last refill time]
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def post(self, event: str, key, data: dict, sid: str | None = None):
+        """
+        Queue an event for sending, replacing the pending event with the same key.
+        """
+        with self.condition:
+            if (event, key) in self.pending:
+                metrics_manager.inc("loop_events_coalesced_total", event=event)
+            self.pending[(event, key)] = (data, sid) # keeps its place in the queue
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="loop-events", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def _take(self, sid: str | None, now: float) -> float:
+        """
+        Take a token of the client bucket. Return 0 if taken, else the delay until a token is available.
+        """
+        tokens, last = self.buckets.get(sid, (self.BURST, now))
+        tokens = min(self.BURST, tokens + (now - last) * self.RATE)
+        if tokens >= 1:
+            self.buckets[sid] = [tokens - 1, now]
+            return 0.0
+        self.buckets[sid] = [tokens, now]
+        return (1 - tokens) / self.RATE
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                now = time.monotonic()
+                ready, delay = [], None
+                for (event, key), (data, sid) in list(self.pending.items()):
+                    wait = self._take(sid, now)
+                    if wait == 0.0:
+                        del self.pending[(event, key)]
+                        ready.append((event, data, sid))
+                    else:
+                        delay = wait if delay is None else min(delay, wait)
+                if not ready:
+                    self.condition.wait(delay)
+                    continue
+            for event, data, sid in ready:
+                try:
+                    PromptServer.instance.send_sync(event, data, sid)
+                    metrics_manager.inc("loop_events_sent_total", event=event)
+                except Exception as e:
+                    logger.error(f"Failed to send {event} event: {e}")
+
+    def pending_count(self) -> int:
+        with self.condition:
+            return len(self.pending)
+
+# Global instance
+event_scheduler = LoopEventScheduler()
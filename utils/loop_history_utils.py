@@ -0,0 +1,250 @@
+import os
+import sys
+import json
+import time
+import zlib
+import shutil
+import hashlib
+import argparse
+
+try:
+    from .loop_path_utils import LoopPathUtils
+except ImportError: # run as a script
+    from loop_path_utils import LoopPathUtils
+
+class LoopHistoryUtils:
+    """
+    Content-addressed step history of loop files (Save Any save_steps).
+    Each step is a small manifest listing the chunks of the saved file, its batch elements and side files
+    (or of every file of a folder, e.g. a canvas). Unchanged files (same mtime and size as the last step) record no step.
+    Chunks are stored once, compressed, and shared by every step : a step only costs the chunks that changed.
+    Steps are materialized back to files on demand, from Python or the command line :
+        python utils/loop_history_utils.py list /path/to/loop_file.png
+        python utils/loop_history_utils.py materialize /path/to/loop_file.png --step 12
+    """
+
+    FOLDER = ".loop_steps" # next to the saved file, one store per file name
+    CHUNK_BYTES = 256 * 1024 # fixed offsets : uncompressed png, raw and canvas files only change where pixels changed
+    COMPRESS_LEVEL = 1
+    SIDE_FILES = (".idx", ".lines", ".cursor") # journal index, lines index and cursor of text loops
+
+    @staticmethod
+    def store_path(path: str) -> str:
+        folder, name = os.path.split(os.path.abspath(path))
+        return os.path.join(folder, LoopHistoryUtils.FOLDER, name)
+
+    @staticmethod
+    def _files(path: str) -> list[str]:
+        """
+        Return the keys of the files to record : relative paths in a folder, or for a single file
+        "" (the file), "#1", "#2"... (batch elements name.00001.ext...) and "+.idx"... (side files).
+        """
+        if not os.path.isdir(path):
+            files, i = [""], 1
+            while os.path.exists(LoopPathUtils.batch_path(path, i)):
+                files.append(f"#{i}")
+                i += 1
+            return files + [f"+{ext}" for ext in LoopHistoryUtils.SIDE_FILES if os.path.exists(path + ext)]
+        files = []
+        for root, _, names in os.walk(path):
+            for name in names:
+                files.append(os.path.relpath(os.path.join(root, name), path).replace(os.sep, "/"))
+        return sorted(files)
+
+    @staticmethod
+    def _file_path(path: str, key: str, folder: bool) -> str:
+        """
+        Return the path of a recorded file key (see _files) for a loop file or folder at path.
+        """
+        if folder:
+            return os.path.join(path, *key.split("/"))
+        if key.startswith("#"):
+            return LoopPathUtils.batch_path(path, int(key[1:]))
+        if key.startswith("+"):
+            return path + key[1:]
+        return path
+
+    @staticmethod
+    def _stats(path: str, files: list[str]) -> dict:
+        folder = os.path.isdir(path)
+        stats = {}
+        for key in files:
+            st = os.stat(LoopHistoryUtils._file_path(path, key, folder))
+            stats[key] = (st.st_mtime_ns, st.st_size)
+        return stats
+
+    @staticmethod
+    def _chunk_path(store: str, digest: str) -> str:
+        return os.path.join(store, "chunks", digest[:2], digest)
+
+    @staticmethod
+    def _put_chunk(store: str, data: bytes) -> str:
+        """
+        Store a chunk if it is not already stored, return its digest.
+        """
+        digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+        chunk_path = LoopHistoryUtils._chunk_path(store, digest)
+        if not os.path.exists(chunk_path):
+            os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+            tmp = LoopPathUtils.temp_path(chunk_path)
+            with open(tmp, "wb") as f:
+                f.write(zlib.compress(data, LoopHistoryUtils.COMPRESS_LEVEL))
+            os.replace(tmp, chunk_path)
+        return digest
+
+    @staticmethod
+    def record_step(path: str, keep: int = 0, thin: int = 0) -> str | None:
+        """
+        Record the current content of path (with its batch elements and side files) as a new step,
+        then apply the retention policy (see prune).
+        Return the manifest path, None if path doesn't exist yet or is unchanged since the last step (same mtime and size).
+        """
+        if not os.path.exists(path):
+            return None
+        folder = os.path.isdir(path)
+        stats = LoopHistoryUtils._stats(path, LoopHistoryUtils._files(path))
+
+        steps = LoopHistoryUtils.list_steps(path)
+        if steps:
+            with open(steps[-1]["manifest"], "r", encoding="utf-8") as f:
+                last = json.load(f)["files"]
+            if last.keys() == stats.keys() and all(tuple(last[k].get("stat", ())) == stat for k, stat in stats.items()):
+                return None
+
+        store = LoopHistoryUtils.store_path(path)
+        files = {}
+        for key, stat in stats.items():
+            chunks, size = [], 0
+            with open(LoopHistoryUtils._file_path(path, key, folder), "rb") as f:
+                while data := f.read(LoopHistoryUtils.CHUNK_BYTES):
+                    chunks.append(LoopHistoryUtils._put_chunk(store, data))
+                    size += len(data)
+            files[key] = {"size": size, "stat": list(stat), "chunks": chunks}
+
+        seq = steps[-1]["step"] + 1 if steps else 0
+        timestamp = f"{time.time():.6f}".replace(".", "")
+        manifest_path = os.path.join(store, "manifests", f"{seq:06d}_{timestamp}.json")
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+        tmp = LoopPathUtils.temp_path(manifest_path)
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"step": seq, "time": timestamp, "folder": folder, "files": files}, f)
+        os.replace(tmp, manifest_path)
+
+        LoopHistoryUtils.prune(path, keep, thin)
+        return manifest_path
+
+    @staticmethod
+    def list_steps(path: str) -> list[dict]:
+        """
+        Return the recorded steps of path, oldest first, as {"step", "time", "manifest"}.
+        """
+        folder = os.path.join(LoopHistoryUtils.store_path(path), "manifests")
+        if not os.path.isdir(folder):
+            return []
+        steps = []
+        for name in os.listdir(folder):
+            if name.endswith(".json") and not name.startswith("."):
+                seq, timestamp = name[:-5].split("_", 1)
+                steps.append({"step": int(seq), "time": timestamp, "manifest": os.path.join(folder, name)})
+        return sorted(steps, key=lambda s: s["step"])
+
+    @staticmethod
+    def prune(path: str, keep: int = 0, thin: int = 0):
+        """
+        Keep the last keep steps (0 : every step). Older steps are deleted, or thinned to one step in thin.
+        Chunks no longer used by any step are deleted.
+        """
+        if keep <= 0:
+            return
+        steps = LoopHistoryUtils.list_steps(path)
+        old = steps[:-keep]
+        dropped = [s for s in old if thin <= 0 or s["step"] % thin != 0]
+        if not dropped:
+            return
+        for step in dropped:
+            os.remove(step["manifest"])
+
+        store = LoopHistoryUtils.store_path(path)
+        used = set()
+        for step in LoopHistoryUtils.list_steps(path):
+            with open(step["manifest"], "r", encoding="utf-8") as f:
+                for entry in json.load(f)["files"].values():
+                    used.update(entry["chunks"])
+        for root, _, names in os.walk(os.path.join(store, "chunks")):
+            for name in names:
+                if name not in used:
+                    os.remove(os.path.join(root, name))
+
+    @staticmethod
+    def materialize(path: str, step: int = -1, dest: str | None = None) -> str:
+        """
+        Rebuild a recorded step of path (-1 : latest) as a file or folder, by default next to path with the step timestamp as suffix.
+        Return the materialized path.
+        """
+        steps = LoopHistoryUtils.list_steps(path)
+        found = steps[-1:] if step < 0 else [s for s in steps if s["step"] == step]
+        if not found:
+            raise ValueError(f"No step {step} recorded for {path}")
+        with open(found[0]["manifest"], "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+
+        if dest is None:
+            root, ext = os.path.splitext(os.path.abspath(path))
+            dest = f"{root}_{manifest['time']}{ext}"
+        store = LoopHistoryUtils.store_path(path)
+
+        def write(file_path: str, entry: dict):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with open(file_path, "wb") as out:
+                for digest in entry["chunks"]:
+                    with open(LoopHistoryUtils._chunk_path(store, digest), "rb") as f:
+                        out.write(zlib.decompress(f.read()))
+
+        if not manifest["folder"]:
+            # each file (with its batch elements and side files) is replaced atomically, stale ones are removed
+            for key in LoopHistoryUtils._files(dest) if os.path.isfile(dest) else []:
+                if key and key not in manifest["files"]:
+                    os.remove(LoopHistoryUtils._file_path(dest, key, False))
+            for key, entry in manifest["files"].items():
+                file_path = LoopHistoryUtils._file_path(dest, key, False)
+                tmp = LoopPathUtils.temp_path(file_path)
+                try:
+                    write(tmp, entry)
+                    os.replace(tmp, file_path)
+                except BaseException:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+                    raise
+            return dest
+
+        tmp = LoopPathUtils.temp_path(dest)
+        try:
+            for rel, entry in manifest["files"].items():
+                write(os.path.join(tmp, *rel.split("/")), entry)
+            if os.path.isdir(dest):
+                shutil.rmtree(dest)
+            os.replace(tmp, dest)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return dest
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Save Any step history (save_steps)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    list_parser = commands.add_parser("list", help="list the recorded steps of a loop file")
+    list_parser.add_argument("path")
+    materialize_parser = commands.add_parser("materialize", help="rebuild a recorded step as a file")
+    materialize_parser.add_argument("path")
+    materialize_parser.add_argument("--step", type=int, default=-1, help="step number (default : latest)")
+    materialize_parser.add_argument("--dest", default=None, help="output path (default : next to the loop file, with the step timestamp)")
+    args = parser.parse_args(argv)
+
+    if args.command == "list":
+        for step in LoopHistoryUtils.list_steps(args.path):
+            print(f"{step['step']:6d}  {step['time']}")
+    else:
+        print(LoopHistoryUtils.materialize(args.path, args.step, args.dest))
+
+if __name__ == "__main__":
+    sys.exit(main())
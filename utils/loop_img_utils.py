@@ -1,206 +1,421 @@
 from PIL import Image, ImageOps
 from PIL.PngImagePlugin import PngInfo
 import os
+import io
 import numpy as np
 import torch
 import torch.nn.functional as F
-import re
-import json
-from itertools import count
+import time
 import hashlib
+import weakref
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from .loop_path_utils import LoopPathUtils
+from .loop_metadata_utils import LoopMetadataUtils
+
+try: # optional, zstd compressed raw files
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
 
 class LoopImageUtils:
     """Utility class for managing images"""
 
+    # loop file extension for each image/mask format
+    IMAGE_FORMATS = {"png": ".png", "webp lossless": ".webp", "raw fp32": ".npy", "raw fp16": ".f16.npy"}
+    if zstandard is not None:
+        IMAGE_FORMATS["raw zstd"] = ".npy.zst"
+    # raw tensor extensions, longest suffix first
+    RAW_FORMATS = {".f16.npy": torch.float16, ".npy.zst": torch.float32, ".npy": torch.float32}
+    # file signatures, readers detect the format from the content
+    MAGIC = {b"\x93NUMPY": "npy", b"\x28\xb5\x2f\xfd": "zstd"}
+    # lossless webp (method, quality) for compress levels 0-9, method 6 is far slower for a few bytes
+    WEBP_LEVELS = ((0, 0), (0, 75), (1, 25), (1, 50), (1, 75), (2, 75), (3, 75), (4, 75), (4, 100), (5, 100))
+
+    # PIL releases the GIL while encoding/decoding, batch elements are processed in parallel
+    CODEC_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="loop-codec")
+
+    # id(mask) -> (weakref, tensor version, stats), see mask_stats
+    # (not a WeakKeyDictionary : it compares tensors with ==)
+    MASK_STATS = {}
+    MASK_STRIP = 64 # rows per occupancy strip
+
     @staticmethod
-    def save_preview_image(image: torch.Tensor, dir: str, scale: float) -> str:
+    def save_preview_mask(mask: torch.Tensor, file_path: str, scale: float = 1.0, size: tuple[int, int] | None = None) -> str:
         """
-        Save an image tensor as JPEG in the specified folder and return filename.
+        Save a mask image tensor as binary PNG to file_path and return filename.
+        size : (h, w) of the image the mask is shown on (default : mask size), the mask is resized straight to the preview size.
         """
-        img = Image.fromarray((image[0].detach().cpu().numpy() * 255).astype(np.uint8))
+        mask_proc = mask[:1] if mask.ndim == 3 else mask.unsqueeze(0)
+        h, w = size or mask_proc.shape[-2:]
 
-        if scale != 1.0:
-            _, h, w, _ = image.shape
-            img = img.resize((int(w*scale), int(h*scale)), Image.LANCZOS)       
+        # resize first, then binary mask for fast preview
+        mask_proc = mask_proc.detach().unsqueeze(1).float()
+        preview_size = (max(1, int(h * min(scale, 1.0))), max(1, int(w * min(scale, 1.0))))
+        if tuple(mask_proc.shape[-2:]) != preview_size:
+            shrink = mask_proc.shape[-2] >= preview_size[0] and mask_proc.shape[-1] >= preview_size[1]
+            mask_proc = F.interpolate(mask_proc, size=preview_size, mode="area" if shrink else "nearest")
+        mask_proc = mask_proc[0, 0]
+        mask_np = LoopImageUtils.to_uint8(mask_proc > 0.5)
+
+        h, w = mask_np.shape
+        rgba = np.zeros((h, w, 4), dtype=np.uint8)
+        rgba[..., 3] = mask_np  # alpha = intensité du masque
 
-        existing = [p for p in os.listdir(dir) if p.startswith("preview_") and p.endswith(".jpeg")]
-        pattern = re.compile(r"preview_(\d{5})\.jpeg")
-        numbers = {int(pattern.match(f).group(1)) for f in existing if pattern.match(f)}
-        counter = next(c for c in count() if c not in numbers)
+        pil_mask = Image.fromarray(rgba, mode="RGBA")
 
-        filename = f"preview_{counter:05d}.jpeg"
-        file_path = os.path.join(dir, filename)
-        img.save(file_path, format="JPEG", quality=60, optimize=False, progressive=False)
-        
-        return filename
+        pil_mask.save(file_path, format="PNG", compress_level=3, optimize=True)
 
+        return os.path.basename(file_path)
+    
     @staticmethod
-    def save_preview_mask(mask: torch.Tensor, dir: str, scale: float = 1.0) -> str:
+    def raw_dtype(path: str) -> torch.dtype | None:
         """
-        Save a mask image tensor as binary PNG in the specified folder and return filename.
+        Return the storage dtype of a raw tensor file, or None if path is not a raw file.
         """
-        mask_proc = mask[0] if mask.ndim == 3 else mask
+        for ext, dtype in LoopImageUtils.RAW_FORMATS.items():
+            if path.endswith(ext):
+                return dtype
+        return None
 
-        # # precise mask and super-slow preview
-        # mask_np = (mask_proc.detach().clamp(0.0, 1.0).mul_(255)
-        #            .byte().cpu().numpy())
+    @staticmethod
+    def detect_format(path: str) -> str:
+        """
+        Return "npy", "zstd" (compressed npy) or "image" (anything PIL opens : png, webp, qoi...) from the file signature.
+        """
+        with open(path, "rb") as f:
+            head = f.read(8)
+        for magic, kind in LoopImageUtils.MAGIC.items():
+            if head.startswith(magic):
+                return kind
+        return "image"
 
-        # binary mask for fast preview
-        mask_proc = mask_proc.detach().clamp(0.0, 1.0)
-        mask_binary = (mask_proc > 0.5).float()
-        mask_np = (mask_binary * 255).byte().cpu().numpy()
+    @staticmethod
+    def is_raw_file(path: str) -> bool:
+        return LoopImageUtils.detect_format(path) != "image"
 
-        h, w = mask_np.shape
-        rgba = np.zeros((h, w, 4), dtype=np.uint8)
-        rgba[..., 3] = mask_np  # alpha = intensité du masque
+    @staticmethod
+    def save_raw_tensor(tensor: torch.Tensor, path: str) -> torch.Tensor:
+        """
+        Save a tensor as is (no quantization) in a .npy file, with the dtype given by its extension. Return input tensor.
+        .npy.zst files are zstd compressed (fast level, multithreaded).
+        """
+        dtype = LoopImageUtils.raw_dtype(path) or torch.float32
+        array = tensor.detach().to("cpu", dtype).contiguous().numpy()
+        if path.endswith(".zst"):
+            if zstandard is None:
+                raise RuntimeError("raw zstd format needs the zstandard package (pip install zstandard).")
+            buffer = io.BytesIO()
+            np.save(buffer, array, allow_pickle=False)
+            with open(path, "wb") as f:
+                f.write(zstandard.ZstdCompressor(level=1, threads=-1).compress(buffer.getbuffer()))
+            return tensor
+        np.save(path, array, allow_pickle=False)
+        return tensor
 
-        pil_mask = Image.fromarray(rgba, mode="RGBA")
+    @staticmethod
+    def load_raw_tensor(path: str) -> torch.Tensor:
+        """
+        Memory-map a raw .npy tensor file and return a float32 tensor.
+        Copy-on-write mapping : pages are read on access and never written back. zstd files are decompressed in memory.
+        """
+        if LoopImageUtils.detect_format(path) == "zstd":
+            if zstandard is None:
+                raise RuntimeError(f"{path} is zstd compressed, install the zstandard package to load it.")
+            with open(path, "rb") as f:
+                data = zstandard.ZstdDecompressor().stream_reader(f).read()
+            tensor = torch.from_numpy(np.load(io.BytesIO(data), allow_pickle=False))
+            return tensor if tensor.dtype == torch.float32 else tensor.float()
 
-        if scale != 1.0:
-            new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
-            pil_mask = pil_mask.resize(new_size, Image.Resampling.BILINEAR)
+        # Windows can't replace a file while it's mapped
+        arr = np.load(path, mmap_mode="c" if os.name != "nt" else None, allow_pickle=False)
+        tensor = torch.from_numpy(arr)
+        return tensor if tensor.dtype == torch.float32 else tensor.float()
 
-        base = "mask_preview_"
-        existing = [f for f in os.listdir(dir) if f.startswith(base)]
-        num = len(existing)
-        filename = f"{base}{num:05d}.png"
-        file_path = os.path.join(dir, filename)
+    @staticmethod
+    def preview_level(image: torch.Tensor | np.ndarray, size: tuple[int, int]) -> np.ndarray:
+        """
+        Return a uint8 preview (H, W, 3) of size (h, w) of the first image of a batch (B, H, W, 3),
+        or of a finer uint8 preview (H, W, 3).
+        """
+        if isinstance(image, np.ndarray):
+            image = LoopImageUtils.from_uint8([image])
+        x = image[:1].detach().movedim(-1, 1).float()
+        if tuple(size) != tuple(x.shape[-2:]):
+            x = F.interpolate(x, size=tuple(size), mode="area")
+        return LoopImageUtils.to_uint8(x.movedim(1, -1))[0]
 
-        pil_mask.save(file_path, format="PNG", compress_level=3, optimize=True)
+    @staticmethod
+    def encode_jpeg(array: np.ndarray, quality: int = 60) -> bytes:
+        """
+        Encode a uint8 array (H, W, 3) as JPEG bytes.
+        """
+        buffer = io.BytesIO()
+        Image.fromarray(array).save(buffer, format="JPEG", quality=quality, optimize=False, progressive=False)
+        return buffer.getvalue()
+
+    @staticmethod
+    def downscale(x: torch.Tensor, scale: float) -> torch.Tensor:
+        """
+        Antialiased (area/box) downscale of a (B, C, H, W) tensor by scale. No-op for scale >= 1.
+        """
+        if scale >= 1.0:
+            return x
+        h, w = x.shape[-2:]
+        size = (max(1, int(h * scale)), max(1, int(w * scale)))
+        return F.interpolate(x.float(), size=size, mode="area")
 
-        return filename
-    
     @staticmethod
     def load_existing_image(path: str) -> torch.Tensor:
         """
-        Load an existing image from path and return a tensor (1, H, W, 3)
+        Load an existing image (or image batch) from path and return a tensor (B, H, W, 3)
         """
-        img = Image.open(path)
-        img = ImageOps.exif_transpose(img)
+        if LoopImageUtils.is_raw_file(path):
+            tensor = LoopImageUtils.load_raw_tensor(path)
+            return tensor[..., :3] if tensor.shape[-1] == 4 else tensor # 4th channel is the mask
 
-        if img.mode == 'I':
-            img = img.point(lambda i: i * (1 / 255))
-        img = img.convert("RGB")
+        def decode(img):
+            img = ImageOps.exif_transpose(img)
+            if img.mode == 'I':
+                img = img.point(lambda i: i * (1 / 255))
+            return np.array(img.convert("RGB"))
 
-        tensor = torch.from_numpy(np.array(img).astype(np.float32) / 255.0)[None, ...]
-
-        return tensor
+        return LoopImageUtils.from_uint8(LoopImageUtils._load_batch(path, decode))
 
     @staticmethod
-    def save_new_image(image: torch.Tensor, path: str, metadata: PngInfo | None = None) -> torch.Tensor:
+    def save_new_image(image: torch.Tensor, path: str, metadata: PngInfo | None = None, compress_level: int = 0) -> torch.Tensor:
         """
-        Save image to path and return input tensor.
+        Save image (or image batch) to path and return input tensor.
         """
-        img = Image.fromarray((image[0].cpu().numpy() * 255).astype(np.uint8))
-        img.save(path, pnginfo=metadata, compress_level=0)
+        if LoopImageUtils.raw_dtype(path):
+            return LoopImageUtils.save_raw_tensor(image, path)
+
+        LoopImageUtils._save_batch(LoopImageUtils.to_uint8(image), path, metadata, compress_level)
 
         return image
 
     @staticmethod
-    def save_image_with_alpha_mask(image: torch.Tensor, mask: torch.Tensor, path: str, metadata: PngInfo | None = None) -> torch.Tensor:
+    def save_image_with_alpha_mask(image: torch.Tensor, mask: torch.Tensor, path: str, metadata: PngInfo | None = None, compress_level: int = 0) -> torch.Tensor:
         """
-        Save image with mask as alpha channel to path and return input image tensor.
+        Save image (or image batch) with mask as alpha channel to path and return input image tensor.
         """
-        # keep first batch element for image [H, W, C]
-        image_single = image[0] if image.ndim == 4 else image
-        
-        # # first batch element for mask 
+        if image.ndim == 3: # [H, W, C]
+            image = image.unsqueeze(0)
         if mask.ndim == 2:  # [H, W]
-            mask_single = mask.unsqueeze(0)
-        elif mask.ndim == 3:  # [B, H, W] ou [1, H, W]
-            mask_single = mask[:1]  # keep first mask in batch [1, H, W]
-        else:
+            mask = mask.unsqueeze(0)
+        elif mask.ndim != 3:
             raise ValueError(f"Mask must have shape [H, W] or [B, H, W], got {mask.shape}")
-                
-        # Get image dimensions
-        h, w, c = image_single.shape
-        
-        # Resize mask to match image dimensions if needed
-        mask_resized = LoopImageUtils.resize_mask(mask_single, h, w)
-        
-        # Clamp and prepare mask for alpha channel
-        mask_clamped = mask_resized.clamp(0.0, 1.0)
-        alpha_np = ((1.0 - mask_clamped[0]) * 255).cpu().numpy().astype(np.uint8) # [0] remove batch dim and invert mask for alpha
-        
-        image_clamped = image_single.clamp(0.0, 1.0)
-        image_np = (image_clamped.cpu().numpy() * 255).astype(np.uint8)
-        
-        # Convert image numpy array to PIL Image
-        if c == 1:  # Grayscale
-            img_pil = Image.fromarray(image_np[:, :, 0], mode='L')
-            img_pil = img_pil.convert('RGB')
-        elif c == 3:  # RGB
-            img_pil = Image.fromarray(image_np, mode='RGB')
-        else:
+
+        b, h, w, c = image.shape
+        if c not in (1, 3):
             raise ValueError(f"Unsupported number of channels: {c}")
-        
-        # Add alpha channel
-        img_with_alpha = img_pil.copy()
-        img_with_alpha.putalpha(Image.fromarray(alpha_np, mode='L'))
-        
-        img_with_alpha.save(path, pnginfo=metadata, compress_level=0)
-        
+
+        mask = LoopImageUtils.alpha_mask(mask, b, h, w).to(image.device, image.dtype)
+
+        if LoopImageUtils.raw_dtype(path):
+            # raw file : mask (not inverted) stored as a 4th channel
+            LoopImageUtils.save_raw_tensor(torch.cat((image[..., :3], mask.unsqueeze(-1)), dim=-1), path)
+            return image
+
+        if c == 1:  # Grayscale
+            image = image.expand(-1, -1, -1, 3)
+        # invert mask for alpha
+        rgba = torch.cat((image, 1.0 - mask.unsqueeze(-1)), dim=-1)
+        LoopImageUtils._save_batch(LoopImageUtils.to_uint8(rgba), path, metadata, compress_level)
+
         return image
 
     @staticmethod
-    def prepare_metadata(prompt: str, extra_pnginfo: str) -> PngInfo:
+    def alpha_mask(mask: torch.Tensor, b: int, h: int, w: int) -> torch.Tensor:
         """
-        Feed a pngInfo object with metadata.
+        Return the mask saved as alpha of an image batch (b, h, w) : resized to the image, one mask per batch element.
         """
-        # metadata = None
-        metadata = PngInfo()
-        if prompt is not None:
-            metadata.add_text("prompt", json.dumps(prompt))
-        if extra_pnginfo is not None:
-            for x in extra_pnginfo:
-                metadata.add_text(x, json.dumps(extra_pnginfo[x]))
-        return metadata
+        if mask.ndim == 2:
+            mask = mask.unsqueeze(0)
+        mask = LoopImageUtils.resize_mask(mask, h, w).clamp(0.0, 1.0)
+        return mask[:1].expand(b, -1, -1) if mask.shape[0] != b else mask
+
+    @staticmethod
+    def stored_value(tensor: torch.Tensor, path: str, invert: bool = False) -> torch.Tensor:
+        """
+        Return tensor as loading it back from path gives it (8-bit or fp16 quantization), as a new cpu float32 tensor.
+        invert : quantized as 1 - tensor, like mask alpha channels.
+        """
+        dtype = LoopImageUtils.raw_dtype(path)
+        if dtype is not None:
+            return tensor.detach().to("cpu", dtype, copy=True).float()
+        if invert:
+            return 1.0 - torch.from_numpy(LoopImageUtils.to_uint8(1.0 - tensor)).float().div_(255.0)
+        return torch.from_numpy(LoopImageUtils.to_uint8(tensor)).float().div_(255.0)
+
+    @staticmethod
+    def prepare_metadata(prompt: str, extra_pnginfo: str, mode: str = "text", folder: str | None = None) -> PngInfo:
+        """
+        Feed a pngInfo object with metadata (see LoopMetadataUtils for modes).
+        """
+        return LoopMetadataUtils.png_info(prompt, extra_pnginfo, mode, folder)
     
     @staticmethod
     def load_existing_mask(path: str) -> torch.Tensor:
         """
-        Load an existing mask (.png) and return a mask tensor (1, H, W)
+        Load an existing mask (.png) or mask batch and return a mask tensor (B, H, W)
         """
-        img = Image.open(path).convert("L")  # 8-bit grayscale
-        img = ImageOps.exif_transpose(img)  # EXIF rotation
+        if LoopImageUtils.is_raw_file(path):
+            return LoopImageUtils.load_raw_tensor(path)
 
-        mask_np = np.array(img).astype(np.float32) / 255.0
-        mask_tensor = torch.from_numpy(mask_np)[None, ...]
+        # 8-bit grayscale, EXIF rotation
+        decode = lambda img: np.array(ImageOps.exif_transpose(img.convert("L")))
 
-        return mask_tensor
+        return LoopImageUtils.from_uint8(LoopImageUtils._load_batch(path, decode))
 
     @staticmethod
-    def save_new_mask(mask: torch.Tensor, path: str, metadata: PngInfo | None = None) -> torch.Tensor:
+    def save_new_mask(mask: torch.Tensor, path: str, metadata: PngInfo | None = None, compress_level: int = 0) -> torch.Tensor:
         """
-        save a mask (1, H, W) in a .png file and return mask tensor input
+        save a mask (B, H, W) in a .png file (one file per batch element) and return mask tensor input
         """
         # Check shape
-        assert mask.ndim == 3 and mask.shape[0] == 1, \
-            f"Mask must be of shape (1, H, W), received {mask.shape}"
+        assert mask.ndim == 3, f"Mask must be of shape (B, H, W), received {mask.shape}"
+
+        if LoopImageUtils.raw_dtype(path):
+            return LoopImageUtils.save_raw_tensor(mask, path)
 
-        # Clamp
-        mask_clamped = mask.clamp(0.0, 1.0)
-        mask_np = (mask_clamped[0].cpu().numpy() * 255).astype(np.uint8)
-        pil_mask = Image.fromarray(mask_np, mode="L")
-        # pil_mask.save(path)
-        pil_mask.save(path, pnginfo=metadata, compress_level=0)
+        LoopImageUtils._save_batch(LoopImageUtils.to_uint8(mask), path, metadata, compress_level)
 
         return mask
-    
+
     @staticmethod
     def get_mask_from_image_alpha(path: str, h: int, w: int) -> torch.Tensor:
         """
-        Return a mask from alpha channel of an image file path, or empty mask
+        Return a mask (B, H, W) from alpha channel of an image file path, or empty mask
         """
-        img = Image.open(path)
-        img = ImageOps.exif_transpose(img)
+        if LoopImageUtils.is_raw_file(path):
+            tensor = LoopImageUtils.load_raw_tensor(path)
+            if tensor.shape[-1] == 4:
+                return tensor[..., 3]
+            return torch.zeros((1, h, w), dtype=torch.float32, device="cpu")
 
-        if 'A' in img.getbands():
-            mask_out = np.array(img.getchannel('A')).astype(np.float32) / 255.0
-            mask_out = 1. - torch.from_numpy(mask_out)
-            return mask_out.unsqueeze(0)
-        else:
+        def decode(img):
+            img = ImageOps.exif_transpose(img)
+            return np.array(img.getchannel('A')) if 'A' in img.getbands() else None
+
+        alphas = LoopImageUtils._load_batch(path, decode)
+        if any(a is None for a in alphas):
             return torch.zeros((1, h, w), dtype=torch.float32, device="cpu")
+        return 1. - LoopImageUtils.from_uint8(alphas)
+
+    @staticmethod
+    def to_uint8(tensor: torch.Tensor) -> np.ndarray:
+        """
+        Convert a float tensor in [0, 1] to a uint8 array in one vectorized pass (on the tensor device, before transfer).
+        """
+        return (tensor.detach().clamp(0.0, 1.0) * 255).to(torch.uint8).cpu().numpy()
+
+    @staticmethod
+    def from_uint8(arrays: list[np.ndarray]) -> torch.Tensor:
+        """
+        Stack uint8 arrays in a float32 tensor in [0, 1] in one vectorized pass.
+        """
+        return torch.from_numpy(np.stack(arrays)).float().div_(255.0)
+
+    @staticmethod
+    def _encode(array: np.ndarray, path: str, info: PngInfo | None = None, compress_level: int = 0):
+        """
+        Encode a uint8 array with the codec of the path extension : png (zlib level 0-9) or lossless webp (see WEBP_LEVELS).
+        webp has no text chunks, info is written as EXIF (see LoopMetadataUtils.exif).
+        """
+        img = Image.fromarray(array)
+        if path.lower().endswith(".webp"):
+            # exact : keep colors under transparent pixels (mask as alpha)
+            method, quality = LoopImageUtils.WEBP_LEVELS[compress_level]
+            exif = {"exif": LoopMetadataUtils.exif(info)} if info is not None and info.chunks else {}
+            img.save(path, format="WEBP", lossless=True, exact=True, method=method, quality=quality, **exif)
+        else:
+            img.save(path, format="PNG", pnginfo=info, compress_level=compress_level)
+
+    @staticmethod
+    def _save_batch(arrays: np.ndarray, path: str, metadata: PngInfo | None = None, compress_level: int = 0):
+        """
+        Encode a uint8 batch (B, H, W[, C]) as png/webp files in parallel.
+        First element goes to path (png : with the batch size as a text chunk), next ones to name.00001.png ...
+        Extra elements are written atomically, path itself is handled by the caller. Stale elements of a larger batch are removed.
+        """
+        b = arrays.shape[0]
+        target = LoopPathUtils.target_path(path)
+
+        info = PngInfo()
+        if metadata is not None:
+            info.chunks = list(metadata.chunks)
+        if b > 1:
+            info.add_text("loop_batch", str(b))
+
+        def encode(i):
+            if i == 0:
+                LoopImageUtils._encode(arrays[0], path, info, compress_level)
+                return
+            element_path = LoopPathUtils.batch_path(target, i)
+            tmp = LoopPathUtils.temp_path(element_path)
+            LoopImageUtils._encode(arrays[i], tmp, None, compress_level)
+            os.replace(tmp, element_path)
+
+        if b == 1:
+            encode(0)
+        else:
+            list(LoopImageUtils.CODEC_POOL.map(encode, range(b)))
+
+        # formats without text chunks are counted from their element files
+        i = max(b, 1)
+        while os.path.exists(stale := LoopPathUtils.batch_path(target, i)):
+            os.remove(stale)
+            i += 1
+
+    @staticmethod
+    def _load_batch(path: str, decode) -> list:
+        """
+        Decode an image file and its batch elements (see _save_batch) in parallel with decode(PIL image).
+        """
+        with Image.open(path) as img:
+            b = img.info.get("loop_batch")
+            first = decode(img)
+        if b is None: # no text chunk (webp...) : count element files
+            b = 1
+            while os.path.exists(LoopPathUtils.batch_path(path, b)):
+                b += 1
+        b = int(b)
+        if b == 1:
+            return [first]
+
+        def load(i):
+            with Image.open(LoopPathUtils.batch_path(path, i)) as img:
+                return decode(img)
+
+        return [first] + list(LoopImageUtils.CODEC_POOL.map(load, range(1, b)))
+
+    @staticmethod
+    def profile_codecs(image: torch.Tensor, levels: tuple = (0, 1, 6, 9), repeat: int = 3) -> list[dict]:
+        """
+        Measure every loop file format on an image (or image batch) : encode and decode time (best of repeat, ms) and file size.
+        Return one {"format", "level", "encode_ms", "decode_ms", "bytes"} entry per format and compression level.
+        """
+        results = []
+        with tempfile.TemporaryDirectory(prefix="loop-codecs-") as dir:
+            for name, ext in LoopImageUtils.IMAGE_FORMATS.items():
+                path = os.path.join(dir, f"profile{ext}")
+                for level in (levels if LoopImageUtils.raw_dtype(path) is None else (0,)):
+                    encode, decode = float("inf"), float("inf")
+                    for _ in range(repeat):
+                        start = time.perf_counter()
+                        LoopImageUtils.save_new_image(image, path, compress_level=level)
+                        encode = min(encode, time.perf_counter() - start)
+                        start = time.perf_counter()
+                        LoopImageUtils.load_existing_image(path).sum() # touch memory-mapped pages
+                        decode = min(decode, time.perf_counter() - start)
+                    files = [path] if LoopImageUtils.raw_dtype(path) else [LoopPathUtils.batch_path(path, i) for i in range(image.shape[0])]
+                    size = sum(os.path.getsize(f) for f in files)
+                    results.append({"format": name, "level": level, "encode_ms": encode * 1000, "decode_ms": decode * 1000, "bytes": size})
+        return results
 
     @staticmethod
     def get_mask_from_image_tensor(image: torch.Tensor, h: int, w: int) -> torch.Tensor:
@@ -225,6 +440,61 @@ class LoopImageUtils:
             ).squeeze(0)
         return mask
 
+    @staticmethod
+    def crop_mask(mask: torch.Tensor, h: int, w: int, x: int, y: int, size: int) -> torch.Tensor:
+        """
+        Return the size x size crop at x, y of a mask as if it was resized to h, w (nearest),
+        gathering only the crop pixels. Masks with nothing under the crop return zeros at once.
+        """
+        mh, mw = mask.shape[-2:]
+        if (mh, mw) == (h, w):
+            return mask[:, y:y+size, x:x+size]
+
+        # same source indices as F.interpolate(mode="nearest")
+        rows = (torch.arange(y, y + size, device=mask.device).float() * (mh / h)).floor().long().clamp_(max=mh - 1)
+        cols = (torch.arange(x, x + size, device=mask.device).float() * (mw / w)).floor().long().clamp_(max=mw - 1)
+
+        bbox = LoopImageUtils.mask_stats(mask)["bbox"]
+        if bbox is None or rows[-1] < bbox[0] or rows[0] >= bbox[1] or cols[-1] < bbox[2] or cols[0] >= bbox[3]:
+            return torch.zeros((mask.shape[0], size, size), dtype=mask.dtype, device=mask.device)
+        return mask[:, rows][:, :, cols]
+
+    @staticmethod
+    def mask_stats(mask: torch.Tensor) -> dict:
+        """
+        Return max value, bounding box (y0, y1, x0, x1) of nonzero pixels and occupancy of a mask (all batch elements).
+        Occupancy is a list of horizontal strips (y0, y1, x0, x1, opaque) covering every nonzero pixel,
+        opaque when the whole strip is at the max value. Cached per tensor until it is modified in place.
+        """
+        key = id(mask)
+        cached = LoopImageUtils.MASK_STATS.get(key)
+        if cached is not None and cached[0]() is mask and cached[1] == mask._version:
+            return cached[2]
+
+        m = mask.detach()
+        mask_max = m.max().item() if m.numel() else 0.0
+        bbox, strips = None, []
+        if mask_max > 0:
+            nz = (m > 0).reshape(-1, *m.shape[-2:]).any(0) # (H, W)
+            rows = nz.any(1).nonzero()
+            y0, y1 = rows[0].item(), rows[-1].item() + 1
+            for s0 in range(y0, y1, LoopImageUtils.MASK_STRIP):
+                s1 = min(s0 + LoopImageUtils.MASK_STRIP, y1)
+                cols = nz[s0:s1].any(0).nonzero()
+                if len(cols) == 0:
+                    continue
+                x0, x1 = cols[0].item(), cols[-1].item() + 1
+                strips.append((s0, s1, x0, x1, bool((m[..., s0:s1, x0:x1] == mask_max).all())))
+            bbox = (y0, y1, min(s[2] for s in strips), max(s[3] for s in strips))
+
+        stats = {"max": mask_max, "bbox": bbox, "strips": strips}
+        def forget(ref):
+            if LoopImageUtils.MASK_STATS.get(key, (None,))[0] is ref:
+                del LoopImageUtils.MASK_STATS[key]
+
+        LoopImageUtils.MASK_STATS[key] = (weakref.ref(mask, forget), mask._version, stats)
+        return stats
+
     @staticmethod
     def get_mask_size(mask: torch.Tensor) -> tuple:
         """
@@ -290,7 +560,7 @@ class LoopImageUtils:
             return hashlib.md5(data).hexdigest()
 
         except Exception as e:
-            print(f"[HASH ERROR image] {e}")
+            logger.warning(f"Image hash failed: {e}")
             return None
 
     @staticmethod
@@ -328,5 +598,5 @@ class LoopImageUtils:
             return hashlib.md5(data).hexdigest()
                         
         except Exception as e:
-            print(f"[HASH ERROR mask] {e}")
+            logger.warning(f"Mask hash failed: {e}")
             return None
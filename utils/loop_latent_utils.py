@@ -1,28 +1,46 @@
 import torch
 import safetensors.torch
+from safetensors import safe_open
 import os
-import json
+from .loop_cache_manager import cache_manager
+from .loop_write_manager import write_manager
+from .loop_metadata_utils import LoopMetadataUtils
 
 
 class LoopLatentUtils:
     """Utility class for managing latents"""
     
     @staticmethod
-    def _load_or_create(latent: torch.Tensor, path: str, load: bool) -> torch.Tensor:
+    def _load_or_create(latent: torch.Tensor, path: str, load: bool, batch: slice | None = None, frames: slice | None = None) -> torch.Tensor:
         """
-        Internal method to load or create a latent.
+        Internal method to load or create a latent, optionally keeping only a batch/frame window.
         """
         if os.path.exists(path) and load:
-            return LoopLatentUtils.load_existing_latent(path)
+            if batch is None and frames is None:
+                return cache_manager.get_or_load(path, LoopLatentUtils.load_existing_latent)
+            # only the window is copied out of the cache
+            cached = cache_manager.get(path, select=lambda latent: LoopLatentUtils.select_latent(latent, batch, frames))
+            if cached is not None:
+                return cached
+            return LoopLatentUtils.load_existing_latent(path, batch, frames)
         else:
-            return LoopLatentUtils.save_new_latent(latent, path)
+            write_manager.write(path, LoopLatentUtils.save_new_latent, latent, cache={"data": LoopLatentUtils.stored_value(latent)})
+            return LoopLatentUtils.select_latent(LoopLatentUtils.stored_value(latent), batch, frames)
 
     @staticmethod
-    def load_or_create_latent(latent: torch.Tensor, path: str, load: bool) -> tuple[torch.Tensor, int, int]:
+    def stored_value(latent: dict) -> dict:
+        """
+        Return latent as loading it back gives it : float32 cpu samples only, as a new tensor.
+        """
+        samples = latent["samples"] if isinstance(latent, dict) else latent
+        return {"samples": samples.detach().to("cpu", torch.float32, copy=True)}
+
+    @staticmethod
+    def load_or_create_latent(latent: torch.Tensor, path: str, load: bool, batch: slice | None = None, frames: slice | None = None) -> tuple[torch.Tensor, int, int]:
         """
         Load an existing latent or save it and return its size
         """
-        latent_out = LoopLatentUtils._load_or_create(latent, path, load)
+        latent_out = LoopLatentUtils._load_or_create(latent, path, load, batch, frames)
         w, h = LoopLatentUtils.get_latent_size(latent_out)
         return latent_out, w, h
 
@@ -34,17 +52,65 @@ class LoopLatentUtils:
         return LoopLatentUtils._load_or_create(latent, path, load)
     
     @staticmethod
-    def load_existing_latent(path: str) -> dict[str, torch.Tensor]:
+    def load_existing_latent(path: str, batch: slice | None = None, frames: slice | None = None) -> dict[str, torch.Tensor]:
         """
-        load a .latent and return a dict {'samples': tensor 4D}.
+        load a .latent and return a dict {'samples': tensor 4D/5D}.
+        The file is memory-mapped and only the selected batch/frame window is read.
         Apply multiplier if the file is ancient.
         """
-        latent = safetensors.torch.load_file(path, device="cpu") # version code comfyui
-        multiplier = 1.0
-        if "latent_format_version_0" not in latent:
-            multiplier = 1.0 / 0.18215
-        samples = {"samples": latent["latent_tensor"].float() * multiplier}
-        return samples
+        with safe_open(path, framework="pt", device="cpu") as f: # version code comfyui
+            multiplier = 1.0
+            if "latent_format_version_0" not in f.keys():
+                multiplier = 1.0 / 0.18215
+
+            if batch is None and frames is None:
+                samples = f.get_tensor("latent_tensor")
+            else:
+                tensor_slice = f.get_slice("latent_tensor")
+                index = (batch or slice(None),)
+                if frames is not None and len(tensor_slice.get_shape()) == 5: # [B, C, T, H, W]
+                    index += (slice(None), frames)
+                samples = tensor_slice[index]
+
+        # fresh tensor : convert and scale only when needed, in place
+        if samples.dtype != torch.float32:
+            samples = samples.float()
+        if multiplier != 1.0:
+            samples.mul_(multiplier)
+        return {"samples": samples}
+
+    @staticmethod
+    def select_latent(latent: dict, batch: slice | None = None, frames: slice | None = None) -> dict:
+        """
+        Return a view of latent samples restricted to a batch range and (5D latents) a frame range.
+        """
+        if batch is None and frames is None:
+            return latent
+        samples = latent["samples"]
+        index = (batch or slice(None),)
+        if frames is not None and samples.ndim == 5:
+            index += (slice(None), frames)
+        selected = {k: v for k, v in latent.items() if k not in ("samples", "noise_mask", "batch_index")}
+        selected["samples"] = samples[index]
+        return selected
+
+    @staticmethod
+    def parse_range(text: str | None) -> slice | None:
+        """
+        Parse a python-like range string ("4", "2:10", ":8", "-16:") into a slice. Empty means everything.
+        """
+        if text is None or not text.strip():
+            return None
+        parts = [p.strip() for p in text.split(":")]
+        try:
+            if len(parts) == 1:
+                start = int(parts[0])
+                return slice(start, start + 1 if start != -1 else None)
+            if len(parts) == 2:
+                return slice(int(parts[0]) if parts[0] else None, int(parts[1]) if parts[1] else None)
+        except ValueError:
+            pass
+        raise ValueError(f"Invalid range '{text}', expected 'start:stop'")
 
     @staticmethod
     def save_new_latent(latent: torch.Tensor, path: str, metadata: dict | None = None) -> torch.Tensor:
@@ -88,17 +154,11 @@ class LoopLatentUtils:
         return (0, 0)
 
     @staticmethod
-    def prepare_metadata(prompt: str, extra_pnginfo: str) -> dict[str, str]:
+    def prepare_metadata(prompt: str, extra_pnginfo: str, mode: str = "text", folder: str | None = None) -> dict[str, str]:
         """
-        Feed a dict with metadata.
+        Feed a dict with metadata (see LoopMetadataUtils for modes).
         """
-        prompt_info = ""
-        if prompt is not None:
-            prompt_info = json.dumps(prompt)
-
-        metadata = None
-        metadata = {"prompt": prompt_info}
-        if extra_pnginfo is not None:
-            for x in extra_pnginfo:
-                metadata[x] = json.dumps(extra_pnginfo[x])
+        metadata = LoopMetadataUtils.text_metadata(prompt, extra_pnginfo, mode, folder)
+        if "loop_metadata" not in metadata:
+            metadata.setdefault("prompt", "")
         return metadata
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import json
+import zlib
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+from .loop_path_utils import LoopPathUtils
+
+class LoopMetadataUtils:
+    """
+    Save metadata (prompt and workflow), compressed once per content and reused across loop iterations.
+    Modes : "text" (plain, as ComfyUI writes it), "compressed" (png zTXt, zlib in latent metadata),
+    "reference" (written once to a .loop_metadata json next to the file, files only store its name).
+    """
+
+    MODES = ["text", "compressed", "reference"]
+    FOLDER = ".loop_metadata"
+    COMPRESS_LEVEL = 9 # once per distinct content
+    MAX_ENTRIES = 32
+    ZLIB_PREFIX = "zlib:" # compressed latent metadata values : prefix + base64
+
+    _lock = threading.Lock()
+    _encoded = OrderedDict() # (kind, text) -> encoded bytes or str
+
+    @staticmethod
+    def serialize(prompt, extra_pnginfo) -> dict[str, str]:
+        """
+        Return metadata entries as json strings. Not memoized : prompts are new objects on every run,
+        and serializing is what a content key would cost. Compressed forms are memoized by content (see _encode).
+        """
+        serialized = {}
+        if prompt is not None:
+            serialized["prompt"] = json.dumps(prompt)
+        if extra_pnginfo is not None:
+            for x in extra_pnginfo:
+                serialized[x] = json.dumps(extra_pnginfo[x])
+        return serialized
+
+    @staticmethod
+    def _encode(kind: str, text: str, encoder):
+        """
+        Memoize encoder(text) by content : a workflow unchanged between iterations is compressed once.
+        """
+        key = (kind, text)
+        with LoopMetadataUtils._lock:
+            encoded = LoopMetadataUtils._encoded.get(key)
+            if encoded is not None:
+                LoopMetadataUtils._encoded.move_to_end(key)
+                return encoded
+        encoded = encoder(text)
+        with LoopMetadataUtils._lock:
+            LoopMetadataUtils._encoded[key] = encoded
+            while len(LoopMetadataUtils._encoded) > LoopMetadataUtils.MAX_ENTRIES:
+                LoopMetadataUtils._encoded.popitem(last=False)
+        return encoded
+
+    @staticmethod
+    def _compress(text: str) -> bytes:
+        return zlib.compress(text.encode("utf-8"), LoopMetadataUtils.COMPRESS_LEVEL)
+
+    @staticmethod
+    def reference(serialized: dict[str, str], folder: str) -> dict[str, str]:
+        """
+        Write the metadata once to folder/.loop_metadata/<digest>.json and return the entry pointing to it.
+        """
+        digest = hashlib.blake2b("\0".join(f"{k}\0{v}" for k, v in serialized.items()).encode("utf-8"), digest_size=16).hexdigest()
+        name = f"{LoopMetadataUtils.FOLDER}/{digest}.json"
+        path = os.path.join(folder, LoopMetadataUtils.FOLDER, f"{digest}.json")
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = LoopPathUtils.temp_path(path)
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("{" + ", ".join(f"{json.dumps(k)}: {v}" for k, v in serialized.items()) + "}")
+            os.replace(tmp, path)
+        return {"loop_metadata": name}
+
+    @staticmethod
+    def png_info(prompt, extra_pnginfo, mode: str = "text", folder: str | None = None) -> PngInfo:
+        """
+        Return a PngInfo with tEXt chunks, or zTXt chunks compressed once per content.
+        """
+        serialized = LoopMetadataUtils.serialize(prompt, extra_pnginfo)
+        if mode == "reference" and folder is not None:
+            serialized = LoopMetadataUtils.reference(serialized, folder)
+            mode = "text"
+        metadata = PngInfo()
+        for key, text in serialized.items():
+            if mode == "compressed":
+                data = LoopMetadataUtils._encode("zlib", text, LoopMetadataUtils._compress)
+                metadata.add(b"zTXt", key.encode("latin-1") + b"\0\0" + data)
+            else:
+                metadata.add_text(key, text)
+        return metadata
+
+    @staticmethod
+    def png_texts(info: PngInfo) -> dict[str, str]:
+        """
+        Return the text chunks (tEXt, zTXt, iTXt) of a PngInfo as a str -> str dict, decompressed.
+        """
+        texts = {}
+        for cid, data, *_ in info.chunks:
+            if cid == b"tEXt":
+                key, text = data.split(b"\0", 1)
+                texts[key.decode("latin-1")] = text.decode("latin-1")
+            elif cid == b"zTXt":
+                key, text = data.split(b"\0", 1)
+                texts[key.decode("latin-1")] = zlib.decompress(text[1:]).decode("latin-1")
+            elif cid == b"iTXt":
+                key, rest = data.split(b"\0", 1)
+                compressed, text = rest[0], rest[2:].split(b"\0", 2)[2] # flag, method, language, translated keyword
+                texts[key.decode("latin-1")] = (zlib.decompress(text) if compressed else text).decode("utf-8")
+        return texts
+
+    @staticmethod
+    def exif(info: PngInfo) -> Image.Exif:
+        """
+        Return the text chunks of a PngInfo as EXIF, laid out as ComfyUI writes WebP files :
+        "prompt:<json>" in Model (0x0110), every other entry as "<key>:<json>" in Make (0x010F) and the tags below.
+        """
+        exif = Image.Exif()
+        tag = 0x010F
+        for key, text in LoopMetadataUtils.png_texts(info).items():
+            if key == "prompt":
+                exif[0x0110] = f"prompt:{text}"
+            else:
+                exif[tag] = f"{key}:{text}"
+                tag -= 1
+        return exif
+
+    @staticmethod
+    def text_metadata(prompt, extra_pnginfo, mode: str = "text", folder: str | None = None) -> dict[str, str]:
+        """
+        Return metadata as a str -> str dict (safetensors, flac tags). Compressed values are prefixed base64 zlib.
+        """
+        serialized = LoopMetadataUtils.serialize(prompt, extra_pnginfo)
+        if mode == "reference" and folder is not None:
+            return LoopMetadataUtils.reference(serialized, folder)
+        if mode == "compressed":
+            encode = lambda t: LoopMetadataUtils.ZLIB_PREFIX + base64.b64encode(LoopMetadataUtils._compress(t)).decode("ascii")
+            return {key: LoopMetadataUtils._encode("b64", text, encode) for key, text in serialized.items()}
+        return dict(serialized)
+
+    @staticmethod
+    def decode_text_metadata(metadata: dict[str, str]) -> dict[str, str]:
+        """
+        Decompress the values of a dict written by text_metadata in compressed mode.
+        """
+        prefix = LoopMetadataUtils.ZLIB_PREFIX
+        return {
+            key: zlib.decompress(base64.b64decode(value[len(prefix):])).decode("utf-8") if value.startswith(prefix) else value
+            for key, value in metadata.items()
+        }
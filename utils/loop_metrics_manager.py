@@ -0,0 +1,174 @@
+import os
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from aiohttp import web
+from server import PromptServer
+
+class LoopMetricsManager:
+    """
+    In-process counters and histograms of the loop hot paths : node calls, file decode and encode, preview hashes and jobs,
+    bytes read and written, cache hits. Served in Prometheus text format on /loop/metrics.
+    """
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0) # seconds
+    METRICS = {
+        "loop_node_seconds": ("histogram", "Node call duration by node and input type."),
+        "loop_decode_seconds": ("histogram", "Loop file decode duration (cache misses) by file type."),
+        "loop_encode_seconds": ("histogram", "Loop file encode and write duration by file type."),
+        "loop_hash_seconds": ("histogram", "Preview change detection hash duration by tensor kind."),
+        "loop_preview_seconds": ("histogram", "Background preview job duration by node."),
+        "loop_read_bytes_total": ("counter", "Bytes of loop files decoded, by file type."),
+        "loop_written_bytes_total": ("counter", "Bytes of loop files written, by file type."),
+        "loop_cache_requests_total": ("counter", "Loop file cache lookups by result."),
+        "loop_preview_skipped_total": ("counter", "Preview work skipped, by node and reason (unchanged, stale)."),
+        "loop_events_sent_total": ("counter", "Websocket events sent to the frontend, by event."),
+        "loop_events_coalesced_total": ("counter", "Websocket events replaced by a newer one before sending, by event."),
+        "loop_bridge_orphans_total": ("counter", "Bridge response futures cleaned up without a response (timeout, cancelled waiter)."),
+    }
+    # file extensions, longest suffix first
+    FILE_TYPES = {
+        ".f16.npy": "raw", ".npy.zst": "raw", ".npy": "raw", ".png": "png", ".webp": "webp", ".latent": "latent",
+        ".flac": "flac", ".audioloop": "audioloop", ".txt": "txt", ".journal": "journal", ".json": "json", ".canvas": "canvas",
+    }
+
+    def __init__(self):
+        self.counters = {} # (name, labels) -> value
+        self.histograms = {} # (name, labels) -> [count per bucket..., +Inf count, sum]
+        self.lock = threading.Lock()
+        self.app = PromptServer.instance.app
+        self.setup_routes()
+
+    def setup_routes(self):
+        """
+        Setup metrics route
+        """
+        self.app.router.add_get('/loop/metrics', self.handle_metrics)
+
+    @staticmethod
+    def _labels(labels: dict) -> tuple:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, self._labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, self._labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.BUCKETS) + 2)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[i] += 1
+                    break
+            else:
+                histogram[-2] += 1
+            histogram[-1] += seconds
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Observe the duration of the with block in histogram name.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def timed(self, node: str, arg: str):
+        """
+        Decorate a node function to observe its duration, labelled with the type of its input argument arg.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                value = kwargs[arg] if arg in kwargs else args[1] if len(args) > 1 else None
+                with self.timer("loop_node_seconds", node=node, type=self.value_type(value)):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @staticmethod
+    def file_type(path: str) -> str:
+        name = os.path.basename(path.rstrip("/\\")).lower()
+        for ext, file_type in LoopMetricsManager.FILE_TYPES.items():
+            if name.endswith(ext):
+                return file_type
+        return "other"
+
+    @staticmethod
+    def value_type(value) -> str:
+        """
+        Loop type of a node input, as matched by Loop Any and Save Any.
+        """
+        if hasattr(value, "dirty") and hasattr(value, "overview"):
+            return "canvas"
+        if hasattr(value, "ndim"):
+            return {4: "image", 3: "mask"}.get(value.ndim, "tensor")
+        if isinstance(value, dict):
+            if "samples" in value:
+                return "latent"
+            if "waveform" in value:
+                return "audio"
+        if isinstance(value, (str, dict, int, float)):
+            return "text"
+        return "other"
+
+    @staticmethod
+    def file_size(path: str) -> int:
+        try:
+            return os.path.getsize(path) if os.path.isfile(path) else 0
+        except OSError:
+            return 0
+
+    @staticmethod
+    def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return ""
+        escape = lambda v: v.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+    def render(self) -> str:
+        """
+        Return every metric in Prometheus text exposition format (0.0.4).
+        """
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: list(v) for k, v in self.histograms.items()}
+        lines = []
+        for name, (kind, help) in self.METRICS.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "counter":
+                for (n, labels), value in sorted(counters.items()):
+                    if n == name:
+                        lines.append(f"{name}{self._format_labels(labels)} {value}")
+                continue
+            for (n, labels), histogram in sorted(histograms.items()):
+                if n != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS + ("+Inf",), histogram[:-1]):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._format_labels(labels, (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {histogram[-1]}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    async def handle_metrics(self, request):
+        headers = {"Content-Type": "text/plain; version=0.0.4; charset=utf-8", "Cache-Control": "no-cache"}
+        return web.Response(body=self.render().encode("utf-8"), headers=headers)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+# Global instance
+metrics_manager = LoopMetricsManager()
@@ -1,5 +1,11 @@
 from pathlib import Path
 import shutil
+import os
+import re
+import uuid
+import logging
+
+logger = logging.getLogger(__name__)
 
 class LoopPathUtils:
     """Utility class for files and path management"""
@@ -27,6 +33,32 @@ class LoopPathUtils:
         except Exception:
             return None, None, None
 
+    @staticmethod
+    def temp_path(path: str) -> str:
+        """
+        Return a hidden temporary path next to path, keeping its full name (formats are guessed from extensions).
+        """
+        folder, name = os.path.split(path)
+        return os.path.join(folder, f".{uuid.uuid4().hex[:8]}.tmp.{name}")
+
+    @staticmethod
+    def target_path(path: str) -> str:
+        """
+        Return the final path of a temporary path built by temp_path (or path itself).
+        """
+        folder, name = os.path.split(path)
+        return os.path.join(folder, re.sub(r"^\.[0-9a-f]{8}\.tmp\.", "", name))
+
+    @staticmethod
+    def batch_path(path: str, index: int) -> str:
+        """
+        Return the path of a batch element : first element is path itself, next ones are name.00001.ext ...
+        """
+        if index == 0:
+            return path
+        root, ext = os.path.splitext(path)
+        return f"{root}.{index:05d}{ext}"
+
     @staticmethod
     def copy_tree(source: str, dest: str) :
         """
@@ -38,6 +70,6 @@ class LoopPathUtils:
         try:
             shutil.copytree(source, dest, dirs_exist_ok=True)
         except FileNotFoundError:
-            print(f"Error: Cannot find source directory")
+            logger.warning(f"Cannot find source directory {source}")
         except Exception as e:
-            print(f"Error while copying: {e}")
\ No newline at end of file
+            logger.error(f"Error while copying {source}: {e}")
\ No newline at end of file
@@ -0,0 +1,250 @@
+import os
+import re
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from server import PromptServer
+from .loop_img_utils import LoopImageUtils
+from .loop_metrics_manager import metrics_manager
+
+logger = logging.getLogger(__name__)
+
+class LoopPreviewManager:
+    """
+    Preview files store for the temp directory.
+    Hands out file names in O(1) from a small ring of slots per node, and evicts old files by count, bytes and age.
+    Leftover previews of a previous session are removed on first use of a directory.
+    Preview jobs run off the prompt thread on a single worker, a newer job for a node cancels the stale one.
+    Also keeps a multi-level preview pyramid per node, served with strong ETags on /loop/preview/{node}/{level}.
+    Pyramid levels are built and JPEG-encoded on first request, from the finest level already built or the source image.
+    Pyramids (sources, levels and encoded bytes) are evicted oldest first beyond MAX_PYRAMID_BYTES, the newest is always kept.
+    """
+
+    SLOTS_PER_KEY = 4 # ring of names per node, so the browser never shows a half written file
+    MAX_FILES = 256
+    MAX_BYTES = 256 * 1024 ** 2
+    MAX_AGE = 3600 # seconds
+    PATTERN = re.compile(r"^loop_(mask_)?preview_[0-9A-Za-z-]+_[0-9]+\.(jpeg|png)$") # only files named by acquire, the temp directory is shared
+    PYRAMID_WIDTHS = (256, 512, 1024, 2048, 4096) # finest level is capped to the last one
+    MAX_PYRAMID_BYTES = 512 * 1024 ** 2
+
+    def __init__(self):
+        self.slots = {} # (prefix, key) -> next slot
+        self.files = OrderedDict() # path -> (bytes, time), oldest first
+        self.total_bytes = 0
+        self.version = 0
+        self.cleaned = set()
+        self.lock = threading.Lock()
+        # single worker : jobs of a node never run concurrently and can keep state on the node
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="loop-preview")
+        self.generations = {} # key -> last submitted job number
+        self.jobs = {} # key -> Future
+        self.pyramids = OrderedDict() # key -> {"version", "source", "sizes", "levels": {level: uint8 array}, "encoded": {level: bytes}, "bytes", "lock"}
+        self.pyramid_bytes = 0
+        self.nonce = uuid.uuid4().hex[:8] # ETags never match a previous session
+        self.app = PromptServer.instance.app
+        self.setup_routes()
+
+    def setup_routes(self):
+        """
+        Setup preview pyramid route
+        """
+        self.app.router.add_get('/loop/preview/{node}/{level}', self.handle_pyramid)
+
+    def pyramid_scales(self, width: int, base_scale: float) -> list[float]:
+        """
+        Return the pyramid scales for an image width, including base_scale (the legacy preview scale).
+        """
+        scales = {min(1.0, lw / width) for lw in self.PYRAMID_WIDTHS}
+        scales.add(base_scale)
+        return sorted(scales)
+
+    def set_pyramid(self, key, image, scales: list[float]) -> dict:
+        """
+        Store the source image (B, H, W, 3) of a node pyramid at scales (coarse to fine) and return its description for the widget.
+        The first image is kept as an 8-bit cpu copy (not a view : it would hold the whole batch, maybe on the gpu),
+        nothing is resized or encoded until a level is requested.
+        """
+        key = str(key)
+        source = LoopImageUtils.to_uint8(image[:1])[0] # new (H, W, 3) array
+        h, w, _ = source.shape
+        sizes = [(max(1, int(h * scale)), max(1, int(w * scale))) for scale in scales]
+        with self.lock:
+            self.version += 1
+            self._drop_pyramid(key)
+            nbytes = source.nbytes
+            self.pyramids[key] = {"version": self.version, "source": source, "sizes": sizes, "levels": {}, "encoded": {}, "bytes": nbytes, "lock": threading.Lock()}
+            self.pyramid_bytes += nbytes
+            self._evict_pyramids()
+            return {"version": self.version, "levels": [[pw, ph] for ph, pw in sizes]}
+
+    def pyramid_level(self, key, level: int) -> tuple[bytes, str] | None:
+        """
+        Return (jpeg bytes, etag) of a pyramid level, building and encoding it if needed.
+        """
+        key = str(key)
+        with self.lock:
+            pyramid = self.pyramids.get(key)
+        if pyramid is None or not 0 <= level < len(pyramid["sizes"]):
+            return None
+        with pyramid["lock"]: # one build per pyramid at a time, other nodes are not blocked
+            data = pyramid["encoded"].get(level)
+            if data is None:
+                finer = [i for i in pyramid["levels"] if i > level]
+                array = LoopImageUtils.preview_level(pyramid["levels"][min(finer)] if finer else pyramid["source"], pyramid["sizes"][level])
+                data = LoopImageUtils.encode_jpeg(array)
+                with self.lock:
+                    pyramid["levels"][level] = array
+                    pyramid["encoded"][level] = data
+                    added = array.nbytes + len(data)
+                    pyramid["bytes"] += added
+                    if self.pyramids.get(key) is pyramid:
+                        self.pyramid_bytes += added
+                        self._evict_pyramids()
+        return data, self.pyramid_etag(key, pyramid["version"], level)
+
+    def _drop_pyramid(self, key: str):
+        pyramid = self.pyramids.pop(key, None)
+        if pyramid is not None:
+            self.pyramid_bytes -= pyramid["bytes"]
+
+    def _evict_pyramids(self):
+        while self.pyramid_bytes > self.MAX_PYRAMID_BYTES and len(self.pyramids) > 1:
+            self._drop_pyramid(next(iter(self.pyramids)))
+
+    def pyramid_etag(self, key, version: int, level: int) -> str:
+        return f'"{self.nonce}-{key}-{version}-{level}"'
+
+    async def handle_pyramid(self, request):
+        """
+        Serve a pyramid level, answering 304 to a conditional GET with a matching ETag.
+        """
+        key = request.match_info["node"]
+        try:
+            level = int(request.match_info["level"])
+        except ValueError:
+            return web.Response(status=400)
+
+        with self.lock:
+            pyramid = self.pyramids.get(key)
+        if pyramid is None or not 0 <= level < len(pyramid["sizes"]):
+            return web.Response(status=404)
+
+        etag = self.pyramid_etag(key, pyramid["version"], level)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("If-None-Match", "")
+        if etag in [t.strip() for t in if_none_match.split(",")] or if_none_match.strip() == "*":
+            return web.Response(status=304, headers=headers)
+
+        found = await asyncio.get_running_loop().run_in_executor(None, self.pyramid_level, key, level)
+        if found is None:
+            return web.Response(status=404)
+        data, etag = found
+        headers["ETag"] = etag
+        return web.Response(body=data, content_type="image/jpeg", headers=headers)
+
+    def submit(self, key, job, *args):
+        """
+        Run job(is_current, *args) in background for a node key, cancelling its previous pending job.
+        is_current() turns False as soon as a newer job is submitted for the same key.
+        """
+        with self.lock:
+            generation = self.generations.get(key, 0) + 1
+            self.generations[key] = generation
+            previous = self.jobs.get(key)
+            if previous is not None and previous.cancel(): # no-op if already running, is_current() stops it
+                metrics_manager.inc("loop_preview_skipped_total", node=job.__qualname__.split(".")[0], reason="stale")
+            future = self.executor.submit(self._run, key, generation, job, *args)
+            self.jobs[key] = future
+        return future
+
+    def is_current(self, key, generation: int) -> bool:
+        with self.lock:
+            return self.generations.get(key) == generation
+
+    def _run(self, key, generation: int, job, *args):
+        is_current = lambda: self.is_current(key, generation)
+        if not is_current():
+            return
+        try:
+            job(is_current, *args)
+        except Exception as e:
+            logger.error(f"Preview job failed for node {key}: {e}")
+        finally:
+            with self.lock:
+                if self.generations.get(key) == generation:
+                    self.jobs.pop(key, None)
+
+    def cleanup(self, dir: str):
+        """
+        Remove the loop preview files of dir (startup cleanup, once per directory and process).
+        Other files of the directory (e.g. previews of other nodes) are never touched.
+        """
+        with self.lock:
+            if dir in self.cleaned:
+                return
+            self.cleaned.add(dir)
+        try:
+            for entry in os.scandir(dir):
+                if entry.is_file() and self.PATTERN.match(entry.name):
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+        except FileNotFoundError:
+            pass
+
+    def acquire(self, dir: str, prefix: str, key, ext: str) -> tuple[str, str, int]:
+        """
+        Return (filename, file_path, version) of the next preview slot for a node key.
+        prefix must match PATTERN ("loop_preview_" or "loop_mask_preview_") for the file to be cleaned up.
+        version increases on each call and can be used as a cache buster.
+        """
+        self.cleanup(dir)
+        key = re.sub(r"[^0-9A-Za-z]", "-", str(key))
+        with self.lock:
+            slot = self.slots.get((prefix, key), 0)
+            self.slots[(prefix, key)] = (slot + 1) % self.SLOTS_PER_KEY
+            self.version += 1
+            version = self.version
+        filename = f"{prefix}{key}_{slot}{ext}"
+        return filename, os.path.join(dir, filename), version
+
+    def commit(self, path: str):
+        """
+        Record a written preview file and evict old ones if needed.
+        """
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self.lock:
+            previous = self.files.pop(path, None)
+            if previous is not None:
+                self.total_bytes -= previous[0]
+            self.files[path] = (size, time.time())
+            self.total_bytes += size
+            self._evict(keep=path)
+
+    def _evict(self, keep: str):
+        now = time.time()
+        while self.files:
+            path, (size, written) = next(iter(self.files.items()))
+            if path == keep:
+                break
+            if len(self.files) <= self.MAX_FILES and self.total_bytes <= self.MAX_BYTES and now - written <= self.MAX_AGE:
+                break
+            del self.files[path]
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# Global instance
+preview_manager = LoopPreviewManager()
@@ -1,19 +1,43 @@
 import os
+import json
+import mmap
+import zlib
+import struct
+import logging
+import numpy as np
+from .loop_cache_manager import cache_manager
+from .loop_path_utils import LoopPathUtils
+from .loop_write_manager import write_manager
+
+try: # optional, faster and parses bytes without decoding them first
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
 
 class LoopStringUtils:
     """Utility class for string and text files management"""
 
+    # journal record : payload length, payload crc32, then utf-8 payload. The .idx file holds one offset per record
+    RECORD_HEADER = struct.Struct("<II")
+    INDEX_ENTRY = struct.Struct("<Q")
+    JOURNAL_SEPARATOR = "\n"
+    # .lines index : mtime_ns and size of the text file, then the offset of every line start (uint64)
+    INDEX_SCAN_BYTES = 16 * 1024 ** 2
+    MMAP_BYTES = 1024 ** 2 # typed values larger than this are parsed from a memory map
+
     @staticmethod
     def load_or_create_text_file(input: str | int |float, path: str, load: bool = True) -> str:
         """
         Load an existing text file or create it.
         """
         if os.path.exists(path) and load:
-            return LoopStringUtils.load_text_file(path)
+            return cache_manager.get_or_load(path, LoopStringUtils.load_text_file)
         else:
             if input is None:
                 input = ""
-            LoopStringUtils.save_text_file(input, path)
+            write_manager.write(path, LoopStringUtils.save_text_file, input)
             return input
 
     @staticmethod
@@ -35,3 +59,288 @@ class LoopStringUtils:
         with open(path, "w", encoding="utf-8") as f:
             f.write(input)
         return path
+
+    @staticmethod
+    def load_or_create_journal(input: str, path: str, load: bool = True, latest: bool = True) -> str:
+        """
+        Load the latest record (or every record, joined by lines) of a journal, or create it with input as first record.
+        """
+        if not (os.path.exists(path) and load):
+            LoopStringUtils.create_journal("" if input is None else input, path)
+        if latest:
+            return cache_manager.get_or_load(path, LoopStringUtils.read_latest_record, "latest")
+        return cache_manager.get_or_load(path, lambda p: LoopStringUtils.JOURNAL_SEPARATOR.join(LoopStringUtils.read_records(p)), "all")
+
+    @staticmethod
+    def create_journal(input: str, path: str) -> str:
+        """
+        Create (or replace) a journal and its index with a single record.
+        """
+        data = str(input).encode("utf-8")
+        tmp = LoopPathUtils.temp_path(path)
+        tmp_index = LoopPathUtils.temp_path(path + ".idx")
+        with open(tmp, "wb") as f:
+            f.write(LoopStringUtils.RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data)
+        with open(tmp_index, "wb") as f:
+            f.write(LoopStringUtils.INDEX_ENTRY.pack(0))
+        os.replace(tmp, path)
+        os.replace(tmp_index, path + ".idx")
+        return path
+
+    @staticmethod
+    def append_record(input: str | int | float, path: str) -> str:
+        """
+        Append a record to a journal and its offset to the index, O(record). A missing journal is created.
+        """
+        if not os.path.exists(path):
+            return LoopStringUtils.create_journal(input, path)
+        data = str(input).encode("utf-8")
+        if not LoopStringUtils._index_is_valid(path):
+            LoopStringUtils.rebuild_index(path)
+        with open(path, "ab") as f:
+            offset = f.tell()
+            f.write(LoopStringUtils.RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data)
+        with open(path + ".idx", "ab") as f:
+            f.write(LoopStringUtils.INDEX_ENTRY.pack(offset))
+        return path
+
+    @staticmethod
+    def _read_record(f, offset: int) -> tuple[str, int] | None:
+        """
+        Read the record at offset of an open journal, return (text, end offset), None if it is truncated or corrupted.
+        """
+        f.seek(offset)
+        header = f.read(LoopStringUtils.RECORD_HEADER.size)
+        if len(header) < LoopStringUtils.RECORD_HEADER.size:
+            return None
+        size, crc = LoopStringUtils.RECORD_HEADER.unpack(header)
+        data = f.read(size)
+        if len(data) < size or zlib.crc32(data) != crc:
+            return None
+        return data.decode("utf-8"), offset + LoopStringUtils.RECORD_HEADER.size + size
+
+    @staticmethod
+    def _last_offset(path: str) -> int | None:
+        try:
+            with open(path + ".idx", "rb") as f:
+                f.seek(0, os.SEEK_END)
+                end = f.tell() - f.tell() % LoopStringUtils.INDEX_ENTRY.size
+                if end == 0:
+                    return None
+                f.seek(end - LoopStringUtils.INDEX_ENTRY.size)
+                return LoopStringUtils.INDEX_ENTRY.unpack(f.read(LoopStringUtils.INDEX_ENTRY.size))[0]
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def _index_is_valid(path: str) -> bool:
+        """
+        O(1) check : the last indexed record is intact and ends the journal.
+        """
+        offset = LoopStringUtils._last_offset(path)
+        if offset is None:
+            return os.path.getsize(path) == 0
+        with open(path, "rb") as f:
+            record = LoopStringUtils._read_record(f, offset)
+            return record is not None and record[1] == os.fstat(f.fileno()).st_size
+
+    @staticmethod
+    def rebuild_index(path: str) -> list[int]:
+        """
+        Rebuild the index by scanning the journal (after an interrupted write), a truncated last record is dropped.
+        """
+        offsets, offset = [], 0
+        with open(path, "rb") as f:
+            while (record := LoopStringUtils._read_record(f, offset)) is not None:
+                offsets.append(offset)
+                offset = record[1]
+        if offset != os.path.getsize(path):
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+        tmp = LoopPathUtils.temp_path(path + ".idx")
+        with open(tmp, "wb") as f:
+            f.write(b"".join(LoopStringUtils.INDEX_ENTRY.pack(o) for o in offsets))
+        os.replace(tmp, path + ".idx")
+        return offsets
+
+    @staticmethod
+    def read_latest_record(path: str) -> str:
+        """
+        Return the last record of a journal, O(record).
+        """
+        if not LoopStringUtils._index_is_valid(path):
+            LoopStringUtils.rebuild_index(path)
+        offset = LoopStringUtils._last_offset(path)
+        if offset is None:
+            return ""
+        with open(path, "rb") as f:
+            return LoopStringUtils._read_record(f, offset)[0]
+
+    @staticmethod
+    def read_records(path: str) -> list[str]:
+        """
+        Return every record of a journal.
+        """
+        if not LoopStringUtils._index_is_valid(path):
+            LoopStringUtils.rebuild_index(path)
+        records, offset = [], 0
+        with open(path, "rb") as f:
+            while (record := LoopStringUtils._read_record(f, offset)) is not None:
+                records.append(record[0])
+                offset = record[1]
+        return records
+
+    @staticmethod
+    def load_or_create_lines(input: str, path: str, load: bool = True, count: int = 1) -> str:
+        """
+        Return the next count lines of a text file at its persisted cursor and advance the cursor (back to the first line at the end).
+        Creating the file from input resets the cursor.
+        """
+        if not (os.path.exists(path) and load):
+            write_manager.write(path, LoopStringUtils.save_text_file, "" if input is None else input, cache={})
+            LoopStringUtils.write_cursor(path, 0)
+
+        offsets = LoopStringUtils.line_index(path)
+        total = len(offsets)
+        if total == 0:
+            return ""
+        cursor = LoopStringUtils.read_cursor(path)
+        if cursor >= total:
+            cursor = 0
+        lines = LoopStringUtils.read_lines(path, offsets, cursor, count)
+        LoopStringUtils.write_cursor(path, cursor + count)
+        return lines
+
+    @staticmethod
+    def line_index(path: str) -> np.ndarray:
+        """
+        Return the line start offsets of a text file (memory-mapped), from its .lines index.
+        The index is rebuilt only when the file mtime or size changed.
+        """
+        stat = os.stat(path)
+        index_path = path + ".lines"
+        try:
+            index = np.memmap(index_path, dtype="<u8", mode="r")
+            if len(index) >= 2 and index[0] == stat.st_mtime_ns and index[1] == stat.st_size:
+                return index[2:]
+        except (FileNotFoundError, ValueError): # missing or empty index
+            pass
+
+        starts = [np.zeros(1, dtype="<u8")] if stat.st_size > 0 else []
+        with open(path, "rb") as f:
+            base = 0
+            while chunk := f.read(LoopStringUtils.INDEX_SCAN_BYTES):
+                newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10).astype("<u8")
+                starts.append(newlines + base + 1)
+                base += len(chunk)
+        offsets = np.concatenate(starts) if starts else np.zeros(0, dtype="<u8")
+        offsets = offsets[offsets < stat.st_size] # no empty line after a final newline
+
+        tmp = LoopPathUtils.temp_path(index_path)
+        np.concatenate([np.array([stat.st_mtime_ns, stat.st_size], dtype="<u8"), offsets]).tofile(tmp)
+        os.replace(tmp, index_path)
+        return offsets
+
+    @staticmethod
+    def read_lines(path: str, offsets: np.ndarray, start: int, count: int = 1) -> str:
+        """
+        Read count lines from line start with a single seek.
+        """
+        begin = int(offsets[start])
+        end = int(offsets[start + count]) if start + count < len(offsets) else None
+        with open(path, "rb") as f:
+            f.seek(begin)
+            data = f.read(end - begin) if end is not None else f.read()
+        return data.decode("utf-8").rstrip("\r\n")
+
+    @staticmethod
+    def read_cursor(path: str) -> int:
+        try:
+            with open(path + ".cursor", "r", encoding="utf-8") as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    @staticmethod
+    def write_cursor(path: str, cursor: int):
+        tmp = LoopPathUtils.temp_path(path + ".cursor")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(str(cursor))
+        os.replace(tmp, path + ".cursor")
+
+    @staticmethod
+    def load_or_create_json_file(input, path: str, load: bool = True):
+        """
+        Load an existing typed value (.json) or create it. Values keep their type (str, int, float, bool, dict, list).
+        """
+        if os.path.exists(path) and load:
+            return cache_manager.get_or_load(path, LoopStringUtils.load_json_file)
+        return LoopStringUtils.write_json_file(input, path)
+
+    @staticmethod
+    def load_json_file(path: str):
+        """
+        Load a typed value. Large files are memory-mapped and parsed in place with orjson.
+        A file that is not json (e.g. a string saved as is) is returned as its text.
+        """
+        size = os.path.getsize(path)
+        with open(path, "rb") as f:
+            if orjson is not None and size > LoopStringUtils.MMAP_BYTES:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    with memoryview(mm) as view:
+                        return LoopStringUtils.decode_json(view)
+            return LoopStringUtils.decode_json(f.read())
+
+    @staticmethod
+    def decode_json(data: bytes | memoryview):
+        """
+        Parse json bytes, or return them as text if they are not json.
+        """
+        try:
+            return orjson.loads(data) if orjson is not None else json.loads(bytes(data))
+        except ValueError: # json and orjson decode errors, invalid utf-8
+            return bytes(data).decode("utf-8", errors="replace")
+
+    @staticmethod
+    def write_json_file(input, path: str, background: bool = False, typed: bool = True):
+        """
+        Write a typed value (typed=False : a string as is) to a .json file through the write manager,
+        and return the value as loading the file gives it (e.g. dict keys as strings, tuples as lists), which is also cached.
+        """
+        data = LoopStringUtils.encode_json(input) if typed else str(input).encode("utf-8")
+        write_manager.write(path, LoopStringUtils._write_bytes, data, background, {"data": LoopStringUtils.decode_json(data)})
+        return LoopStringUtils.decode_json(data)
+
+    @staticmethod
+    def _write_bytes(data: bytes, path: str) -> str:
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    @staticmethod
+    def _json_default(value) -> str:
+        logger.warning(f"Typed value : {type(value).__name__} is not json serializable, saved as its string")
+        return str(value)
+
+    @staticmethod
+    def save_json_file(input, path: str) -> str:
+        """
+        Save a typed value as json and return input path (see encode_json).
+        """
+        return LoopStringUtils._write_bytes(LoopStringUtils.encode_json(input), path)
+
+    @staticmethod
+    def encode_json(input) -> bytes:
+        """
+        Encode a typed value as json. Non string dict keys are saved as strings,
+        values json can't represent (e.g. tensors) as their string with a warning.
+        """
+        data = None
+        if orjson is not None:
+            try:
+                data = orjson.dumps(input, default=LoopStringUtils._json_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+            except TypeError: # e.g. integers over 64 bits, left to json
+                pass
+        if data is None:
+            data = json.dumps(input, ensure_ascii=False, default=LoopStringUtils._json_default).encode("utf-8")
+        return data
@@ -0,0 +1,118 @@
+import json
+import math
+from functools import lru_cache
+import torch
+import torch.nn.functional as F
+
+class LoopTileUtils:
+    """Utility class for tiled cut/paste of images and masks"""
+
+    @staticmethod
+    def grid(h: int, w: int, size: int, overlap: int) -> dict:
+        """
+        Return the tile grid covering an h x w image with square tiles of size and given overlap.
+        The image is padded (bottom/right) so that every tile has the same stride.
+        """
+        overlap = max(0, min(overlap, size - 8))
+        stride = size - overlap
+        rows = math.ceil(max(h - size, 0) / stride) + 1
+        columns = math.ceil(max(w - size, 0) / stride) + 1
+        return {
+            "size": size,
+            "overlap": overlap,
+            "stride": stride,
+            "width": w,
+            "height": h,
+            "rows": rows,
+            "columns": columns,
+            "coords": [[c * stride, r * stride] for r in range(rows) for c in range(columns)],
+        }
+
+    @staticmethod
+    def _pad(x: torch.Tensor, grid: dict) -> torch.Tensor:
+        """
+        Replicate-pad a (B, C, H, W) tensor to the padded grid size.
+        """
+        pad_h = (grid["rows"] - 1) * grid["stride"] + grid["size"] - grid["height"]
+        pad_w = (grid["columns"] - 1) * grid["stride"] + grid["size"] - grid["width"]
+        if pad_h or pad_w:
+            x = F.pad(x, (0, pad_w, 0, pad_h), mode="replicate")
+        return x
+
+    @staticmethod
+    def split_tiles(image: torch.Tensor, size: int, overlap: int, mask: torch.Tensor | None = None) -> tuple[torch.Tensor, torch.Tensor | None, str]:
+        """
+        Cut every tile of an image (B, H, W, C) in a single unfold.
+        Return tiles (B*N, size, size, C), mask tiles (B*N, size, size) if mask is given, and the grid as a JSON string.
+        Tiles are ordered by batch element, then row, then column. A single mask is broadcast to every batch element.
+        """
+        b, h, w, c = image.shape
+        size = min(size, h, w)
+        grid = LoopTileUtils.grid(h, w, size, overlap)
+        stride = grid["stride"]
+
+        padded = LoopTileUtils._pad(image.movedim(-1, 1), grid).movedim(1, -1) # (B, Hp, Wp, C)
+        # zero-copy view (B, rows, columns, C, size, size), one copy when reshaped to a batch
+        tiles = padded.unfold(1, size, stride).unfold(2, size, stride)
+        tiles = tiles.permute(0, 1, 2, 4, 5, 3).reshape(-1, size, size, c)
+
+        mask_tiles = None
+        if mask is not None:
+            if mask.ndim == 2:
+                mask = mask.unsqueeze(0)
+            if mask.shape[0] != b:
+                if mask.shape[0] != 1:
+                    raise ValueError(f"Image Crop : mask batch size {mask.shape[0]} doesn't match image batch size {b}, use {b} masks or 1.")
+                mask = mask.expand(b, -1, -1)
+            if mask.shape[-2:] != (h, w):
+                mask = F.interpolate(mask.unsqueeze(1), size=(h, w), mode="nearest").squeeze(1)
+            padded_mask = LoopTileUtils._pad(mask.unsqueeze(1), grid).squeeze(1) # (Bm, Hp, Wp)
+            mask_tiles = padded_mask.unfold(1, size, stride).unfold(2, size, stride).reshape(-1, size, size)
+
+        return tiles, mask_tiles, json.dumps(grid)
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def _feather(size: int, overlap: int, rows: int, columns: int, device: str, dtype: torch.dtype) -> tuple[torch.Tensor, torch.Tensor]:
+        """
+        Return the feather weights of a tile (size, size) and the matching normalization map (Hp, Wp).
+        Weights ramp linearly over the overlap and never reach zero, so image borders stay covered.
+        """
+        ramp = torch.ones(size, dtype=dtype, device=device)
+        if overlap > 0:
+            r = (torch.arange(overlap, dtype=dtype, device=device) + 1) / (overlap + 1)
+            ramp[:overlap] = r
+            ramp[-overlap:] = torch.minimum(ramp[-overlap:], r.flip(0))
+        weights = ramp[:, None] * ramp[None, :]
+
+        stride = size - overlap
+        out_size = ((rows - 1) * stride + size, (columns - 1) * stride + size)
+        cols = weights.reshape(1, size * size, 1).expand(1, size * size, rows * columns)
+        norm = F.fold(cols, output_size=out_size, kernel_size=size, stride=stride)[0, 0]
+        return weights, norm
+
+    @staticmethod
+    def merge_tiles(tiles: torch.Tensor, grid: str | dict) -> torch.Tensor:
+        """
+        Reassemble tiles (B*N, size, size[, C]) produced by split_tiles with feathered overlaps, in one fold (scatter-add) pass.
+        Return (B, H, W[, C]).
+        """
+        grid = json.loads(grid) if isinstance(grid, str) else grid
+        size, overlap, stride = grid["size"], grid["overlap"], grid["stride"]
+        rows, columns = grid["rows"], grid["columns"]
+        n = rows * columns
+
+        has_channels = tiles.ndim == 4
+        if not has_channels:
+            tiles = tiles.unsqueeze(-1)
+        c = tiles.shape[-1]
+        b = tiles.shape[0] // n
+
+        weights, norm = LoopTileUtils._feather(size, overlap, rows, columns, str(tiles.device), tiles.dtype)
+        cols = (tiles * weights[None, :, :, None]).reshape(b, n, size, size, c)
+        cols = cols.permute(0, 4, 2, 3, 1).reshape(b, c * size * size, n)
+        out_size = ((rows - 1) * stride + size, (columns - 1) * stride + size)
+        merged = F.fold(cols, output_size=out_size, kernel_size=size, stride=stride)
+        merged = (merged / norm)[:, :, :grid["height"], :grid["width"]].movedim(1, -1)
+
+        return merged if has_channels else merged.squeeze(-1)
@@ -0,0 +1,158 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+import torch
+from .loop_cache_manager import cache_manager
+from .loop_metrics_manager import metrics_manager
+from .loop_path_utils import LoopPathUtils
+
+logger = logging.getLogger(__name__)
+
+class LoopWriteManager:
+    """
+    Atomic loop file writer with an optional write-behind mode.
+    Background writes run on a small thread pool, readers of a path wait only for the pending write of that exact file.
+    Failed background writes are kept and raised on the next access to the same path.
+    """
+
+    def __init__(self, max_workers: int | None = None):
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or min(4, os.cpu_count() or 1),
+            thread_name_prefix="loop-writer",
+        )
+        self.pending = {} # abs path -> Future
+        self.errors = {} # abs path -> Exception
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.abspath(path)
+
+    @staticmethod
+    def snapshot(value):
+        """
+        Detach tensors (recursively in dicts) so a background write can't see later in-place changes.
+        """
+        if isinstance(value, torch.Tensor):
+            return value.detach().to("cpu", copy=True)
+        if isinstance(value, dict):
+            return {k: LoopWriteManager.snapshot(v) for k, v in value.items()}
+        return value
+
+    @staticmethod
+    def _write_atomic(path: str, writer, value, cache: dict | None, atomic: bool = True):
+        """
+        Write value to a temporary file with writer(value, tmp_path), then rename it over path.
+        Not atomic : writer(value, path) updates path in place (e.g. appends) and is responsible for its consistency.
+        """
+        file_type = metrics_manager.file_type(path)
+        if not atomic:
+            size = metrics_manager.file_size(path)
+            with metrics_manager.timer("loop_encode_seconds", file=file_type):
+                writer(value, path)
+            metrics_manager.inc("loop_written_bytes_total", max(0, metrics_manager.file_size(path) - size), file=file_type)
+            for kind, cached in (cache or {}).items():
+                cache_manager.put(path, cached, kind, copy=False)
+            return
+        tmp = LoopPathUtils.temp_path(path)
+        try:
+            with metrics_manager.timer("loop_encode_seconds", file=file_type):
+                writer(value, tmp)
+            metrics_manager.inc("loop_written_bytes_total", metrics_manager.file_size(tmp), file=file_type)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        for kind, cached in (cache or {}).items():
+            cache_manager.put(path, cached, kind, copy=False)
+
+    def write(self, path: str, writer, value, background: bool = False, cache: dict | None = None, atomic: bool = True):
+        """
+        Atomically write value to path with writer(value, path).
+        In background mode the value is snapshotted and written by the pool, and the call returns at once.
+        cache maps cache kinds to the values stored once the file is written (default {"data": value}, none if not atomic).
+        Cached values are owned by the cache : pass new tensors (e.g. the stored value), the default value is snapshotted.
+        """
+        key = self._key(path)
+        self.check(key)
+
+        if not background:
+            self.wait(key)
+            if cache is None and atomic:
+                cache = {"data": self.snapshot(value)}
+            self._write_atomic(key, writer, value, cache, atomic)
+            return None
+
+        value = self.snapshot(value)
+        if cache is None and atomic:
+            cache = {"data": value} # the snapshot is only read by the writer
+
+        with self.lock:
+            previous = self.pending.get(key)
+            future = self.executor.submit(self._run, key, previous, writer, value, cache, atomic)
+            self.pending[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _run(self, key: str, previous: Future | None, writer, value, cache: dict | None, atomic: bool):
+        # keep writes to the same file in submission order
+        if previous is not None:
+            try:
+                previous.result()
+            except Exception:
+                pass
+        self._write_atomic(key, writer, value, cache, atomic)
+
+    def _done(self, key: str, future: Future):
+        with self.lock:
+            if getattr(future, "loop_handled", False): # done callback and wait() may both land here
+                return
+            future.loop_handled = True
+            if self.pending.get(key) is future:
+                del self.pending[key]
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Background write failed for {key}: {error}")
+                self.errors[key] = error
+
+    def wait(self, path: str):
+        """
+        Read barrier: block until the pending write of path (if any) is finished, and raise its error.
+        """
+        key = self._key(path)
+        with self.lock:
+            future = self.pending.get(key)
+        if future is not None:
+            try:
+                future.result()
+            except Exception:
+                pass
+            self._done(key, future)
+        self.check(key)
+
+    def check(self, path: str):
+        """
+        Raise (once) the error of a failed background write of path.
+        """
+        key = self._key(path)
+        with self.lock:
+            error = self.errors.pop(key, None)
+        if error is not None:
+            raise RuntimeError(f"Previous background write of {key} failed: {error}") from error
+
+    def flush(self):
+        """
+        Wait for every pending write.
+        """
+        with self.lock:
+            futures = list(self.pending.values())
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+
+# Global instance
+write_manager = LoopWriteManager()